@@ -1,9 +1,13 @@
 import asyncio
 import json
-from datetime import timedelta
+import time
+from contextlib import aclosing
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import sha256
 from http import HTTPStatus
 from os import getenv
-from typing import Any, Optional, Union
+from typing import Any, Awaitable, Callable, Optional, Union
 from urllib.parse import quote_plus, urljoin
 from uuid import UUID
 
@@ -15,7 +19,6 @@ from azure.communication.callautomation.aio import CallAutomationClient
 from azure.core.credentials import AzureKeyCredential
 from azure.core.messaging import CloudEvent
 from azure.eventgrid import EventGridEvent, SystemEventNames
-from htmlmin.minify import html_minify
 from jinja2 import Environment, FileSystemLoader
 from pydantic import TypeAdapter, ValidationError
 from twilio.twiml.messaging_response import MessagingResponse
@@ -42,6 +45,9 @@ from helpers.logging import logger
 from helpers.monitoring import CallAttributes, span_attribute, tracer
 from helpers.pydantic_types.phone_numbers import PhoneNumber
 from helpers.resources import resources_dir
+from helpers.single_flight import SingleFlight
+from helpers.speech import audio_aget
+from helpers.templating import WhitespaceExtension
 from models.call import CallGetModel, CallInitiateModel, CallStateModel
 from models.next import ActionEnum as NextActionEnum
 from models.readiness import ReadinessCheckModel, ReadinessEnum, ReadinessModel
@@ -54,16 +60,23 @@ logger.info(
 
 # Jinja configuration
 _jinja = Environment(
+    auto_reload=False,  # Templates are deployed with the app, do not check for updates
     autoescape=True,
     enable_async=True,
+    extensions=[WhitespaceExtension],  # Minify HTML, once per template
+    lstrip_blocks=True,
     loader=FileSystemLoader("public_website"),
-    optimized=False,  # Outsource optimization to html_minify
+    trim_blocks=True,
 )
 # Jinja custom functions
 _jinja.filters["quote_plus"] = lambda x: quote_plus(str(x)) if x else ""
-_jinja.filters["markdown"] = lambda x: (
-    mistune.create_markdown(plugins=["abbr", "speedup", "url"])(x) if x else ""
-)  # pyright: ignore
+_markdown = mistune.create_markdown(
+    plugins=["abbr", "speedup", "url"]
+)  # Parser is stateless between calls, build it once
+_jinja.filters["markdown"] = lambda x: _markdown(x) if x else ""  # pyright: ignore
+# Compile templates at startup, not on the first request
+for _template in _jinja.list_templates():
+    _jinja.get_template(_template)
 
 # Azure Communication Services
 _automation_client: Optional[CallAutomationClient] = None
@@ -80,6 +93,57 @@ _db = CONFIG.database.instance()
 _search = CONFIG.ai_search.instance()
 _sms = CONFIG.sms.instance()
 
+
+def _tts_warmup_done(task: asyncio.Task) -> None:
+    """
+    Log the error of the TTS prompts warm-up, if any.
+
+    Prompts not warmed-up are translated on first use.
+    """
+    if task.cancelled():
+        return
+    if exc := task.exception():
+        logger.warning("Error warming-up TTS prompts", exc_info=exc)
+
+
+# Warm-up TTS prompts, kept referenced to prevent garbage collection
+_tts_warmup: Optional[asyncio.Task] = None
+try:
+    _tts_warmup = asyncio.get_running_loop().create_task(CONFIG.prompts.tts.awarm())
+    _tts_warmup.add_done_callback(_tts_warmup_done)
+except RuntimeError:
+    # No event loop when imported outside of the Functions host, prompts are translated on first use
+    pass
+
+# Open the store at startup, so a schema migration does not block the first request
+_db_warmup: Optional[asyncio.Task] = None
+try:
+    _db_warmup = asyncio.get_running_loop().create_task(_db.areadiness())
+except RuntimeError:
+    # No event loop when imported outside of the Functions host, store is opened on first use
+    pass
+
+# Readiness, checked in background from the first probe
+_readiness: Optional[ReadinessModel] = None
+_readiness_flight: SingleFlight[ReadinessModel] = SingleFlight()
+_readiness_task: Optional[asyncio.Task] = None
+
+# OpenAPI specification, built once as it only depends on the config
+with open(
+    encoding="utf-8",
+    file=resources_dir("openapi.json"),
+    mode="r",
+) as _f:
+    _openapi = json.load(_f)
+    _openapi["info"]["version"] = CONFIG.version
+    _openapi["servers"] = [
+        {
+            "description": "Public endpoint",
+            "url": str(CONFIG.public_domain),
+        }
+    ]
+    _OPENAPI = json.dumps(_openapi).encode()
+
 # Azure Functions
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
@@ -103,26 +167,44 @@ async def openapi_get(req: func.HttpRequest) -> func.HttpResponse:
 
     No parameters are expected.
 
-    Returns a JSON object with the OpenAPI specification.
+    Returns a JSON object with the OpenAPI specification, built at startup.
     """
-    with open(
-        encoding="utf-8",
-        file=resources_dir("openapi.json"),
-        mode="r",
-    ) as f:
-        openapi = json.load(f)
-        openapi["info"]["version"] = CONFIG.version
-        openapi["servers"] = [
-            {
-                "description": "Public endpoint",
-                "url": str(CONFIG.public_domain),
-            }
-        ]
-        return func.HttpResponse(
-            body=json.dumps(openapi),
-            mimetype="application/json",
-            status_code=HTTPStatus.OK,
+    return func.HttpResponse(
+        body=_OPENAPI,
+        mimetype="application/json",
+        status_code=HTTPStatus.OK,
+    )
+
+
+@app.route(
+    "audio/{key}",
+    methods=["GET"],
+    trigger_arg_name="req",
+)
+@tracer.start_as_current_span("audio_get")
+async def audio_get(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Get a pre-synthesized audio prompt.
+
+    Parameters:
+    - key: Audio key, from its SSML
+
+    Returns a WAV file. Content never changes for a key, so it can be cached by clients.
+    """
+    audio = await audio_aget(req.route_params["key"])
+    if not audio:
+        return _standard_error(
+            message="Audio not found",
+            status_code=HTTPStatus.NOT_FOUND,
         )
+    return func.HttpResponse(
+        body=audio,
+        headers={
+            "Cache-Control": f"public, max-age={CONFIG.cognitive_service.static_audio_ttl_sec}, immutable",
+        },
+        mimetype="audio/wav",
+        status_code=HTTPStatus.OK,
+    )
 
 
 @app.route(
@@ -150,39 +232,16 @@ async def health_readiness_get(req: func.HttpRequest) -> func.HttpResponse:
     """
     Check if the service is ready to serve requests.
 
-    No parameters are expected. Services tested are: cache, store, search, sms.
+    No parameters are expected. Services tested are: cache, store, search, sms. Checks are run in background, the last result is returned without loading the services.
 
     Returns a 200 OK if the service is ready to serve requests. If the service is not ready, it should return a 503 Service Unavailable.
     """
-    # Check all components in parallel
-    (
-        cache_check,
-        store_check,
-        search_check,
-        sms_check,
-    ) = await asyncio.gather(
-        _cache.areadiness(),
-        _db.areadiness(),
-        _search.areadiness(),
-        _sms.areadiness(),
+    readiness = await _use_readiness()
+    status_code = (
+        HTTPStatus.OK
+        if readiness.status == ReadinessEnum.OK
+        else HTTPStatus.SERVICE_UNAVAILABLE
     )
-    readiness = ReadinessModel(
-        status=ReadinessEnum.OK,
-        checks=[
-            ReadinessCheckModel(id="cache", status=cache_check),
-            ReadinessCheckModel(id="store", status=store_check),
-            ReadinessCheckModel(id="startup", status=ReadinessEnum.OK),
-            ReadinessCheckModel(id="search", status=search_check),
-            ReadinessCheckModel(id="sms", status=sms_check),
-        ],
-    )
-    # If one of the checks fails, the whole readiness fails
-    status_code = HTTPStatus.OK
-    for check in readiness.checks:
-        if check.status != ReadinessEnum.OK:
-            readiness.status = ReadinessEnum.FAIL
-            status_code = HTTPStatus.SERVICE_UNAVAILABLE
-            break
     return func.HttpResponse(
         body=readiness.model_dump_json(),
         mimetype="application/json",
@@ -201,39 +260,38 @@ async def report_get(req: func.HttpRequest) -> func.HttpResponse:
     List all calls with a web interface.
 
     Optional URL parameters:
+    - continuation: Token of the next page, from the previous page
     - phone_number: Filter by phone number
 
     Returns a list of calls with a web interface.
     """
+    count = 100
     try:
         phone_number = (
             PhoneNumber(req.params["phone_number"])
             if "phone_number" in req.params
             else None
         )
-    except ValueError as e:
-        return _validation_error(e)
-    count = 100
-    calls, total = (
-        await _db.call_asearch_all(
+        page = await _db.call_asearch_all(
+            continuation=req.params.get("continuation", None),
             count=count,
             phone_number=phone_number or None,
         )
-        or []
-    )
+    except ValueError as e:
+        return _validation_error(e)
     template = _jinja.get_template("list.html.jinja")
     render = await template.render_async(
         applicationinsights_connection_string=getenv(
             "APPLICATIONINSIGHTS_CONNECTION_STRING"
         ),
         bot_phone_number=CONFIG.communication_services.phone_number,
-        calls=calls or [],
+        calls=page.calls,
+        continuation=page.continuation,
         count=count,
         phone_number=phone_number,
-        total=total,
+        total=page.total,
         version=CONFIG.version,
     )
-    render = html_minify(render)  # Minify HTML
     return func.HttpResponse(
         body=render,
         mimetype="text/html",
@@ -253,7 +311,7 @@ async def report_single_get(req: func.HttpRequest) -> func.HttpResponse:
 
     No parameters are expected.
 
-    Returns a single call with a web interface.
+    Returns a single call with a web interface. Finished calls are validated with `ETag` and `Last-Modified`, a 304 is returned without rendering if the client is up to date.
     """
     try:
         call_id = UUID(req.route_params["call_id"])
@@ -265,6 +323,12 @@ async def report_single_get(req: func.HttpRequest) -> func.HttpResponse:
             message=f"Call {call_id} not found",
             status_code=HTTPStatus.NOT_FOUND,
         )
+    headers = _call_cache_headers(call)
+    if headers and _is_not_modified(req, headers):
+        return func.HttpResponse(
+            headers=headers,
+            status_code=HTTPStatus.NOT_MODIFIED,
+        )
     template = _jinja.get_template("single.html.jinja")
     render = await template.render_async(
         applicationinsights_connection_string=getenv(
@@ -277,15 +341,14 @@ async def report_single_get(req: func.HttpRequest) -> func.HttpResponse:
         next_actions=[action for action in NextActionEnum],
         version=CONFIG.version,
     )
-    render = html_minify(render)  # Minify HTML
     return func.HttpResponse(
         body=render,
+        headers=headers,
         mimetype="text/html",
         status_code=HTTPStatus.OK,
     )
 
 
-# TODO: Add total (int) and calls (list) as a wrapper for the list of calls
 @app.route(
     "call",
     methods=["GET"],
@@ -297,33 +360,100 @@ async def call_list_get(req: func.HttpRequest) -> func.HttpResponse:
     REST API to list all calls.
 
     Parameters:
+    - continuation: Token of the next page, from the previous page
     - phone_number: Filter by phone number
 
-    Returns a list of calls objects `CallGetModel`, for a phone number, in JSON format.
+    Returns a page of calls `CallPageModel`, with summaries `CallListModel`, in JSON format.
     """
+    count = 100
     try:
         phone_number = (
             PhoneNumber(req.params["phone_number"])
             if "phone_number" in req.params
             else None
         )
+        page = await _db.call_asearch_all(
+            continuation=req.params.get("continuation", None),
+            count=count,
+            phone_number=phone_number,
+        )
     except ValueError as e:
         return _validation_error(e)
-    count = 100
-    calls, _ = await _db.call_asearch_all(phone_number=phone_number, count=count)
-    if not calls:
+    if not page.calls:
         return _standard_error(
             message=f"Calls {phone_number} not found",
             status_code=HTTPStatus.NOT_FOUND,
         )
-    output = [CallGetModel.model_validate(call) for call in calls or []]
     return func.HttpResponse(
-        body=TypeAdapter(list[CallGetModel]).dump_json(output),
+        body=page.model_dump_json(),
         mimetype="application/json",
         status_code=HTTPStatus.OK,
     )
 
 
+@app.route(
+    "call/export",
+    methods=["GET"],
+    trigger_arg_name="req",
+)
+@tracer.start_as_current_span("call_export_get")
+async def call_export_get(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    REST API to export calls, for bulk processing.
+
+    Parameters:
+    - continuation: Token of the next batch, from the `X-Continuation` header of the previous response
+    - since: Export calls created at or after this date, in ISO 8601 format
+    - until: Export calls created before this date, in ISO 8601 format
+
+    Returns calls objects `CallGetModel`, oldest first, in NDJSON format. Calls are serialized one by one as they are read from the database, by batches of 1000. If more calls are available, the `X-Continuation` header is set. If the database fails during a batch, the calls read are returned with the continuation of the last one, so the export can be resumed; if none was read, a 500 Internal Server Error is returned.
+    """
+    count = 1000
+    adapter = TypeAdapter(CallGetModel)
+    lines: list[bytes] = []
+    continuation: Optional[str] = None
+    try:
+        since = (
+            datetime.fromisoformat(req.params["since"])
+            if "since" in req.params
+            else None
+        )
+        until = (
+            datetime.fromisoformat(req.params["until"])
+            if "until" in req.params
+            else None
+        )
+        async with aclosing(
+            _db.call_aexport(
+                continuation=req.params.get("continuation", None),
+                since=since,
+                until=until,
+            )
+        ) as calls:  # Release the database cursor when the batch is full
+            async for call, continuation in calls:
+                lines.append(adapter.dump_json(call))
+                if len(lines) >= count:
+                    break
+            else:
+                continuation = None  # Export is complete
+    except ValueError as e:
+        return _validation_error(e)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.error("Error exporting calls", exc_info=True)
+        if not lines:
+            return _standard_error(
+                message="Error exporting calls",
+                status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            )
+        # Keep the continuation of the last call read, the client resumes from it
+    return func.HttpResponse(
+        body=b"".join(line + b"\n" for line in lines),
+        headers={"X-Continuation": continuation} if continuation else None,
+        mimetype="application/x-ndjson",
+        status_code=HTTPStatus.OK,
+    )
+
+
 @app.route(
     "call/{phone_number}",
     methods=["GET"],
@@ -766,8 +896,10 @@ async def _communicationservices_event_worker(
         )
 
     await _db.call_aset(
-        call
-    )  # TODO: Do not persist on every event, this is simpler but not efficient
+        call=call,
+        flush=event_type
+        == "Microsoft.Communication.CallDisconnected",  # Make sure the last state is written when the call ends
+    )  # Saves are merged by the store, so persisting on every event is cheap
 
 
 @app.queue_trigger(
@@ -853,7 +985,10 @@ async def _communicationservices_event_url(
                 phone_number=phone_number,
             )
         )
-        await _db.call_aset(call)  # Create for the first time
+        await _db.call_aset(
+            call=call,
+            flush=True,  # Searched by phone number from the DB on the next event
+        )  # Create for the first time
     url = _COMMUNICATIONSERVICES_CALLABACK_TPL.format(
         callback_secret=call.callback_secret,
         call_id=str(call.call_id),
@@ -956,6 +1091,143 @@ def _str_to_contexts(value: Optional[str]) -> Optional[set[CallContextEnum]]:
     return res or None
 
 
+async def _use_readiness() -> ReadinessModel:
+    """
+    Get the last readiness result.
+
+    Checks loop is started on first use. If there is no result yet, or if the last one is older than two intervals, meaning the loop is stuck, the checks are run inline. Concurrent probes share the same run.
+    """
+    global _readiness_task  # pylint: disable=global-statement
+    if not _readiness_task or _readiness_task.done():
+        _readiness_task = asyncio.create_task(_readiness_loop())
+    readiness = _readiness
+    if (
+        not readiness
+        or not readiness.checked_at
+        or datetime.now(UTC) - readiness.checked_at
+        > timedelta(seconds=CONFIG.monitoring.readiness_interval_sec * 2)
+    ):
+        readiness = await _readiness_flight.arun(key=None, func=_readiness_arun)
+    return readiness
+
+
+async def _readiness_loop() -> None:
+    """
+    Run the readiness checks, every `monitoring.readiness_interval_sec`.
+    """
+    while True:
+        try:
+            await _readiness_flight.arun(key=None, func=_readiness_arun)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.error("Error while checking readiness", exc_info=True)
+        await asyncio.sleep(CONFIG.monitoring.readiness_interval_sec)
+
+
+async def _readiness_arun() -> ReadinessModel:
+    """
+    Check all components in parallel, and store the result.
+
+    If one of the checks fails, the whole readiness fails.
+    """
+    global _readiness  # pylint: disable=global-statement
+    checks = await asyncio.gather(
+        _readiness_acheck("cache", _cache.areadiness),
+        _readiness_acheck("store", _db.areadiness),
+        _readiness_acheck("search", _search.areadiness),
+        _readiness_acheck("sms", _sms.areadiness),
+    )
+    readiness = ReadinessModel(
+        checked_at=datetime.now(UTC),
+        checks=[
+            *checks,
+            ReadinessCheckModel(id="startup", status=ReadinessEnum.OK),
+        ],
+        status=(
+            ReadinessEnum.OK
+            if all(check.status == ReadinessEnum.OK for check in checks)
+            else ReadinessEnum.FAIL
+        ),
+    )
+    _readiness = readiness
+    return readiness
+
+
+async def _readiness_acheck(
+    check_id: str,
+    check: Callable[[], Awaitable[ReadinessEnum]],
+) -> ReadinessCheckModel:
+    """
+    Run a readiness check, and measure its latency.
+    """
+    start = time.monotonic()
+    try:
+        status = await check()
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.error(
+            "Unknown error while checking %s readiness", check_id, exc_info=True
+        )
+        status = ReadinessEnum.FAIL
+    return ReadinessCheckModel(
+        duration_ms=round((time.monotonic() - start) * 1000, 2),
+        id=check_id,
+        status=status,
+    )
+
+
+def _call_cache_headers(call: CallStateModel) -> Optional[dict[str, str]]:
+    """
+    Build the HTTP validation headers of a call page.
+
+    Calls in progress change with each message, they are not cached. Finished calls only change with the post-processing (next action and synthesis), included in the ETag, as is the app version for the templates. `Last-Modified` is the last message date, sent once the post-processing is done.
+
+    Returns the headers, or `None` if the call cannot be cached.
+    """
+    if call.in_progress:
+        return None
+    last_modified = (call.messages[-1] if call.messages else call).created_at
+    etag = sha256(
+        json.dumps(
+            [
+                CONFIG.version,
+                str(call.call_id),
+                len(call.messages),
+                last_modified.isoformat(),
+                call.next.model_dump_json() if call.next else None,
+                call.synthesis.model_dump_json() if call.synthesis else None,
+            ]
+        ).encode()
+    ).hexdigest()
+    headers = {
+        "Cache-Control": "no-cache",  # Revalidate each time
+        "ETag": f'"{etag}"',
+    }
+    if call.next and call.synthesis:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(UTC), usegmt=True
+        )
+    return headers
+
+
+def _is_not_modified(req: func.HttpRequest, headers: dict[str, str]) -> bool:
+    """
+    Check if the client already has the response, from its conditional headers.
+
+    `If-None-Match` takes precedence over `If-Modified-Since`, as stated by RFC 9110.
+    """
+    if_none_match = req.headers.get("If-None-Match", None)
+    if if_none_match:
+        return headers["ETag"] in (tag.strip() for tag in if_none_match.split(","))
+    if_modified_since = req.headers.get("If-Modified-Since", None)
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            return parsedate_to_datetime(
+                headers["Last-Modified"]
+            ) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):  # Invalid date
+            return False
+    return False
+
+
 def _validation_error(
     e: Exception,
 ) -> func.HttpResponse:
@@ -444,6 +444,9 @@ async def on_end_call(
         _intelligence_sms(call),
         _intelligence_synthesis(call),
     )
+    await _db.call_aflush(
+        call.call_id
+    )  # Saves of the tasks are merged, write them before the invocation ends
 
 
 async def _intelligence_sms(call: CallStateModel) -> None:
@@ -54,29 +54,111 @@ async def load_llm_chat(
 
     should_play_sound = True
 
+    # Playback queue, so the LLM stream never waits on Communication Services or DB
+    playback_queue: asyncio.Queue[tuple[str, MessageStyleEnum]] = asyncio.Queue(
+        maxsize=10  # Bounded to apply backpressure on the LLM stream if the playback is stuck
+    )
+
+    async def _playback_worker() -> None:
+        """
+        Play the queued TTS in order.
+
+        Text is not stored by the worker, as playback can lag behind the LLM stream, it is stored in stream order when queued. The call is saved in DB only when the queue is drained, coalescing the writes of consecutive sentences.
+        """
+        while True:
+            text, style = await playback_queue.get()
+            try:
+                await handle_recognize_text(
+                    call=call,
+                    client=client,
+                    store=False,  # Stored by the chat, once complete
+                    style=style,
+                    text=text,
+                )
+                if playback_queue.empty():  # Coalesce DB writes
+                    await _db.call_aset(
+                        call
+                    )  # Save in DB allowing (1) user to cut off the Assistant and (2) SMS answers to be in order
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.warning("Error playing TTS", exc_info=True)
+            finally:
+                playback_queue.task_done()
+
+    playback_task = asyncio.create_task(_playback_worker())
+
+    async def _playback_drain() -> None:
+        """
+        Wait for the queued TTS to be played, then stop the worker.
+        """
+        if not playback_task.done():
+            await playback_queue.join()
+        playback_task.cancel()
+
+    def _playback_cancel() -> None:
+        """
+        Stop the worker and drop the queued TTS.
+        """
+        playback_task.cancel()
+        while not playback_queue.empty():
+            playback_queue.get_nowait()
+            playback_queue.task_done()
+
     async def _tts_callback(text: str, style: MessageStyleEnum) -> None:
         """
         Send back the TTS to the user.
+
+        The text is stored in the last assistant message, so the spoken part is kept if the user cuts off the Assistant or if the chat is superseded. Then, it is queued, and played in order by the playback worker. The chat replaces the message content once complete.
         """
         nonlocal should_play_sound
 
         should_play_sound = False
-        await asyncio.gather(
-            handle_recognize_text(
-                call=call,
-                client=client,
-                style=style,
-                text=text,
-            ),  # First, recognize the next voice
-            _db.call_aset(
-                call
-            ),  # Second, save in DB allowing (1) user to cut off the Assistant and (2) SMS answers to be in order
-        )
+        if (
+            call.messages and call.messages[-1].persona == MessagePersonaEnum.ASSISTANT
+        ):  # Append to last message
+            call.messages[-1].content += f" {text}"
+        else:
+            call.messages.append(
+                MessageModel(
+                    content=text,
+                    persona=MessagePersonaEnum.ASSISTANT,
+                    style=style,
+                )
+            )
+        await playback_queue.put((text, style))
 
     # Pointer
     pointer_cache_key = f"{__name__}-load_llm_chat-pointer-{call.call_id}"
+    pointer_channel = f"{__name__}-load_llm_chat-superseded-{call.call_id}"
     pointer_current = time.time()  # Get system current time
-    await _cache.aset(pointer_cache_key, str(pointer_current))
+    pointer_queue = _cache.subscribe(pointer_channel)
+    await _cache.aset(
+        key=pointer_cache_key,
+        ttl_sec=CONFIG.conversation.callback_timeout_hour * 60 * 60,
+        value=str(pointer_current),
+    )
+    await _cache.apublish(
+        channel=pointer_channel,
+        message=str(pointer_current),
+    )  # Stop the previous chat, in any instance
+
+    async def _wait_superseded() -> None:
+        """
+        Wait for a newer chat to be started, in any instance.
+        """
+        while float(await pointer_queue.get()) <= pointer_current:  # Own message
+            continue
+
+    superseded_task = asyncio.create_task(_wait_superseded())
+
+    async def _is_pointer_outdated() -> bool:
+        """
+        Test if pointer updated by another instance.
+
+        Messages are delivered at most once, this catches the ones lost while the cache was disconnected.
+        """
+        return pointer_current < float(
+            (await _cache.aget(pointer_cache_key) or b"0").decode()
+        )
 
     # Chat
     chat_task = asyncio.create_task(
@@ -116,24 +198,41 @@ async def load_llm_chat(
         hard_timeout_task.cancel()
         loading_task.cancel()
         soft_timeout_task.cancel()
+        superseded_task.cancel()
+
+    async def _stop_superseded() -> None:
+        nonlocal is_superseded
+        is_superseded = True
+        logger.warning("Another chat is running, stopping this one")
+        # Clean up playback queue
+        _playback_cancel()
+        # Clean up Communication Services queue
+        await handle_clear_queue(call=call, client=client)
+        # Clean up tasks
+        _clear_tasks()
 
     is_error = True
+    is_superseded = False
     continue_chat = True
     try:
         while True:
+            # Wait for the next event, without polling, so the answer is used as soon as available
+            waiters = {chat_task, hard_timeout_task, superseded_task}
+            if should_play_sound:  # Catch timeout if async loading is not started
+                waiters.add(loading_task)
+                if not soft_timeout_triggered:
+                    waiters.add(soft_timeout_task)
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
             logger.debug("Chat task status: %s", chat_task.done())
 
-            if pointer_current < float(
-                (await _cache.aget(pointer_cache_key) or b"0").decode()
-            ):  # Test if pointer updated by another instance
-                logger.warning("Another chat is running, stopping this one")
-                # Clean up Communication Services queue
-                await handle_clear_queue(call=call, client=client)
-                # Clean up tasks
-                _clear_tasks()
+            if superseded_task.done():  # Another chat started
+                await _stop_superseded()
                 break
 
             if chat_task.done():  # Break when chat coroutine is done
+                if await _is_pointer_outdated():  # Do not commit if outdated
+                    await _stop_superseded()
+                    break
                 # Clean up
                 _clear_tasks()
                 # Get result
@@ -174,6 +273,11 @@ async def load_llm_chat(
                 elif (
                     loading_task.done()
                 ):  # Do not play timeout prompt plus loading, it can be frustrating for the user
+                    if (
+                        await _is_pointer_outdated()
+                    ):  # Double check when a sound is about to be played
+                        await _stop_superseded()
+                        break
                     loading_task = _loading_task()
                     await handle_media(
                         call=call,
@@ -181,28 +285,28 @@ async def load_llm_chat(
                         sound_url=CONFIG.prompts.sounds.loading(),
                     )  # Play loading sound
 
-            # Wait to not block the event loop for other requests
-            await asyncio.sleep(1)
-
     except Exception:  # pylint: disable=broad-exception-caught
         logger.warning("Error loading intelligence", exc_info=True)
 
+    finally:
+        # Clean up tasks, in case of error
+        _clear_tasks()
+        _cache.unsubscribe(pointer_channel, pointer_queue)
+
+    if is_superseded:  # Do not retry, the newer chat answers
+        return call
+
     if is_error:  # Error during chat
         if not continue_chat or _iterations_remaining < 1:  # Maximum retries reached
             logger.warning("Maximum retries reached, stopping chat")
             content = await CONFIG.prompts.tts.error(call)
             style = MessageStyleEnum.NONE
-            await _tts_callback(content, style)
-            call.messages.append(
-                MessageModel(
-                    content=content,
-                    persona=MessagePersonaEnum.ASSISTANT,
-                    style=style,
-                )
-            )
+            await _tts_callback(content, style)  # Stored in the call messages
+            await _playback_drain()
 
         else:  # Retry chat after an error
             logger.info("Retrying chat, %s remaining", _iterations_remaining - 1)
+            await _playback_drain()
             return await load_llm_chat(
                 call=call,
                 client=client,
@@ -213,6 +317,7 @@ async def load_llm_chat(
     else:
         if continue_chat and _iterations_remaining > 0:  # Contiue chat
             logger.info("Continuing chat, %s remaining", _iterations_remaining - 1)
+            await _playback_drain()
             return await load_llm_chat(
                 call=call,
                 client=client,
@@ -222,6 +327,7 @@ async def load_llm_chat(
             )  # Recursive chat (like for for retry or tools)
 
         # End chat
+        await _playback_drain()
         await handle_recognize_text(
             call=call,
             client=client,
@@ -307,8 +413,8 @@ async def _execute_llm_chat(
     tool_calls_buffer: dict[int, MessageToolModel] = {}
     try:
         async for delta in completion_stream(
+            call=call,
             max_tokens=160,  # Lowest possible value for 90% of the cases, if not sufficient, retry will be triggered, 100 tokens ~= 75 words, 20 words ~= 1 sentence, 6 sentences ~= 160 tokens
-            messages=call.messages,
             system=system,
             tools=tools,
         ):
@@ -1,8 +1,10 @@
+import asyncio
 import json
 import re
 from contextlib import asynccontextmanager
 from enum import Enum
-from typing import AsyncGenerator, Generator, Optional
+from typing import AsyncGenerator, Generator, Optional, Union
+from urllib.parse import urljoin
 
 from azure.communication.callautomation import (
     FileSource,
@@ -18,7 +20,10 @@ from azure.communication.callautomation.aio import (
 from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
 from helpers.config import CONFIG
+from helpers.config_models.cache import ModeEnum as CacheModeEnum
+from helpers.config_models.conversation import LanguageEntryModel
 from helpers.logging import logger
+from helpers.speech import audio_aready, audio_asynthesize, audio_key
 from models.call import CallStateModel
 from models.message import (
     MessageModel,
@@ -33,6 +38,9 @@ _TTS_SANITIZER_R = re.compile(
     r"[^\w\sÀ-ÿ'«»“”\"\"‘’''(),.!?;:\-\+_@/&€$%=]"
 )  # Sanitize text for TTS
 
+_audio_static: set[str] = set()  # Static prompts chunks, synthesized on first use
+_audio_tasks: set[asyncio.Task] = set()  # Background syntheses
+
 
 class ContextEnum(str, Enum):
     """
@@ -98,7 +106,7 @@ async def _handle_recognize_media(
                 interrupt_prompt=True,
                 operation_context=_context_builder({context}),
                 play_prompt=(
-                    _audio_from_text(
+                    await _audio_from_text(
                         call=call,
                         style=style,
                         text=text,
@@ -138,7 +146,7 @@ async def _handle_play_text(
         async with _use_call_client(client, call.voice_id) as call_client:
             await call_client.play_media(
                 operation_context=_context_builder({context}),
-                play_source=_audio_from_text(
+                play_source=await _audio_from_text(
                     call=call,
                     style=style,
                     text=text,
@@ -290,8 +298,7 @@ async def _chunk_before_tts(
     Split a text in chunks and store them in the call messages.
     """
     # Sanitize text for TTS
-    text = re.sub(_TTS_SANITIZER_R, " ", text)  # Remove unwanted characters
-    text = re.sub(r"\s+", " ", text)  # Remove multiple spaces
+    text = _tts_sanitize(text)
 
     # Store text in call messages
     if store:
@@ -310,7 +317,22 @@ async def _chunk_before_tts(
                 )
             )
 
-    # Split text in chunks of max 400 characters, separated by sentence
+    return _tts_chunks(text)
+
+
+def _tts_sanitize(text: str) -> str:
+    """
+    Remove characters and spaces that cannot be spoken.
+    """
+    text = re.sub(_TTS_SANITIZER_R, " ", text)  # Remove unwanted characters
+    text = re.sub(r"\s+", " ", text)  # Remove multiple spaces
+    return text
+
+
+def _tts_chunks(text: str) -> list[str]:
+    """
+    Split text in chunks of max 400 characters, separated by sentence.
+    """
     chunks = []
     chunk = ""
     for to_add, _ in tts_sentence_split(text, True):
@@ -320,21 +342,46 @@ async def _chunk_before_tts(
         chunk += to_add
     if chunk:
         chunks.append(chunk)
-
     return chunks
 
 
-def _audio_from_text(
+async def audio_awarm(
+    lang: LanguageEntryModel,
+    prosody_rate: float,
+    texts: list[str],
+) -> None:
+    """
+    Pre-synthesize static prompts, for a voice and a prosody rate.
+
+    Prompts are split like when played, so each chunk is found back by its SSML. Chunks are remembered, to synthesize them on first use with other voices or prosody rates.
+    """
+    if not _static_audio_enabled(lang):
+        return
+    chunks = {chunk for text in texts for chunk in _tts_chunks(_tts_sanitize(text))}
+    _audio_static.update(chunks)
+    ssmls = [
+        _ssml(
+            lang=lang,
+            prosody_rate=prosody_rate,
+            style=MessageStyleEnum.NONE,
+            text=chunk,
+        )
+        for chunk in chunks
+    ]
+    await asyncio.gather(
+        *[audio_asynthesize(key=audio_key(ssml), ssml=ssml) for ssml in ssmls]
+    )
+
+
+async def _audio_from_text(
     call: CallStateModel,
     style: MessageStyleEnum,
     text: str,
-) -> SsmlSource:
+) -> Union[FileSource, SsmlSource]:
     """
     Generate an audio source that can be read by Azure Communication Services SDK.
 
-    Text requires to be SVG escaped, and SSML tags are used to control the voice. Plus, text is slowed down by 5% to make it more understandable for elderly people. Text is also truncated to 400 characters, as this is the limit of Azure Communication Services TTS, but a warning is logged.
-
-    See: https://learn.microsoft.com/en-us/azure/ai-services/speech-service/speech-synthesis-markup-structure
+    Text is truncated to 400 characters, as this is the limit of Azure Communication Services TTS, but a warning is logged. If the static audio mode is enabled and the text is a static prompt pre-synthesized (checked in the shared cache, as the file is served by any instance), the audio file is played instead, without synthesis latency. Static prompts not yet synthesized for this voice and prosody rate are synthesized in the background, for the next time.
     """
     # Azure Speech Service TTS limit is 400 characters
     if len(text) > 400:
@@ -342,24 +389,69 @@ def _audio_from_text(
             "Text is too long to be processed by TTS, truncating to 400 characters, fix this!"
         )
         text = text[:400]
+    ssml = _ssml(
+        lang=call.lang,
+        prosody_rate=call.initiate.prosody_rate,
+        style=style,
+        text=text,
+    )
+    # Try pre-synthesized audio, only static prompts are synthesized
+    if text in _audio_static and _static_audio_enabled(call.lang):
+        key = audio_key(ssml)
+        if await audio_aready(key):
+            return FileSource(
+                url=urljoin(str(CONFIG.public_domain), f"/audio/{key}"),
+            )
+        task = asyncio.create_task(audio_asynthesize(key=key, ssml=ssml))
+        _audio_tasks.add(task)
+        task.add_done_callback(_audio_tasks.discard)
+    return SsmlSource(
+        custom_voice_endpoint_id=call.lang.custom_voice_endpoint_id,
+        ssml_text=ssml,
+    )
+
+
+def _ssml(
+    lang: LanguageEntryModel,
+    prosody_rate: float,
+    style: MessageStyleEnum,
+    text: str,
+) -> str:
+    """
+    Build the SSML of a text.
+
+    Text requires to be SVG escaped, and SSML tags are used to control the voice. Plus, text is slowed down by 5% to make it more understandable for elderly people.
+
+    See: https://learn.microsoft.com/en-us/azure/ai-services/speech-service/speech-synthesis-markup-structure
+    """
     # Escape text for SSML
     text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
     # Build SSML tree
     ssml = f"""
-    <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="{call.lang.short_code}">
-        <voice name="{call.lang.voice}" effect="eq_telecomhp8k">
+    <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="{lang.short_code}">
+        <voice name="{lang.voice}" effect="eq_telecomhp8k">
             <lexicon uri="{CONFIG.resources.public_url}/lexicon.xml" />
-            <lang xml:lang="{call.lang.short_code}">
+            <lang xml:lang="{lang.short_code}">
                 <mstts:express-as style="{style.value}" styledegree="0.5">
-                    <prosody rate="{call.initiate.prosody_rate}">{text}</prosody>
+                    <prosody rate="{prosody_rate}">{text}</prosody>
                 </mstts:express-as>
             </lang>
         </voice>
     </speak>
     """
-    return SsmlSource(
-        custom_voice_endpoint_id=call.lang.custom_voice_endpoint_id,
-        ssml_text=ssml.strip(),
+    return ssml.strip()
+
+
+def _static_audio_enabled(lang: LanguageEntryModel) -> bool:
+    """
+    Check if static prompts can be played from pre-synthesized audio.
+
+    Custom voices are synthesized by Communication Services only, they always use SSML. Files are served by any instance, from the cache, so it must be shared across instances.
+    """
+    return (
+        CONFIG.cognitive_service.static_audio
+        and CONFIG.cache.mode == CacheModeEnum.REDIS
+        and not lang.custom_voice_endpoint_id
     )
 
 
@@ -384,7 +476,7 @@ async def handle_recognize_ivr(
                 input_type=RecognizeInputType.CHOICES,
                 interrupt_prompt=True,
                 operation_context=_context_builder({context}),
-                play_prompt=_audio_from_text(
+                play_prompt=await _audio_from_text(
                     call=call,
                     style=MessageStyleEnum.NONE,
                     text=text,
@@ -7,6 +7,9 @@ from persistence.isearch import ISearch
 
 class AiSearchModel(BaseModel, frozen=True):
     access_key: SecretStr
+    cache_ttl_sec: int = Field(
+        default=60 * 60, ge=1
+    )  # Staleness accepted on search results, 1 hour
     endpoint: str
     expansion_n_messages: int = Field(default=10, ge=1)
     index: str
@@ -1,6 +1,12 @@
-from pydantic import BaseModel, SecretStr
+from pydantic import BaseModel, Field, SecretStr
 
 
 class AiTranslationModel(BaseModel):
     access_key: SecretStr
+    batch_delay_sec: float = Field(
+        default=0.005, ge=0
+    )  # Wait before sending a batch, to group concurrent translations
+    cache_ttl_sec: int = Field(
+        default=30 * 24 * 60 * 60, ge=1
+    )  # Translations do not change, 30 days
     endpoint: str
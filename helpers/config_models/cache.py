@@ -7,13 +7,25 @@ from pydantic import BaseModel, Field, SecretStr, ValidationInfo, field_validato
 from persistence.icache import ICache
 
 
+class CodecEnum(str, Enum):
+    NONE = "none"
+    ZLIB = "zlib"
+
+
 class ModeEnum(str, Enum):
     MEMORY = "memory"
     REDIS = "redis"
 
 
 class MemoryModel(BaseModel, frozen=True):
-    max_size: int = Field(default=100, ge=10)
+    codec: CodecEnum = (
+        CodecEnum.NONE
+    )  # Compression saves memory, but costs CPU on every read
+    max_bytes: int = Field(default=256 * 1024 * 1024, ge=1024)  # 256 MiB
+    max_size: int = Field(default=10000, ge=10)
+    ttl_sec: Optional[int] = Field(
+        default=24 * 60 * 60, gt=0
+    )  # Default expiration of the items, 1 day
 
     @lru_cache(maxsize=None)  # pylint: disable=method-cache-max-size-none
     def instance(self) -> ICache:
@@ -25,8 +37,12 @@ class MemoryModel(BaseModel, frozen=True):
 
 
 class RedisModel(BaseModel, frozen=True):
+    codec: CodecEnum = CodecEnum.ZLIB  # Compression saves network and memory
     database: int = Field(default=0, ge=0)
     host: str
+    l1: Optional[MemoryModel] = (
+        None  # In-process cache in front of Redis, kept coherent with pub/sub
+    )
     password: SecretStr
     port: int = 6379
     ssl: bool = True
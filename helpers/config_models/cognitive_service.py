@@ -1,5 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class CognitiveServiceModel(BaseModel):
     endpoint: str
+    static_audio: bool = False  # Pre-synthesize static prompts, played as files
+    static_audio_ttl_sec: int = Field(
+        default=7 * 24 * 60 * 60, ge=1
+    )  # Synthesized audio, 7 days
@@ -162,6 +162,10 @@ class ConversationModel(BaseModel):
         default=180,  # 3 mins
         serialization_alias="intelligence_hard_timeout_sec",  # Compatibility with v7
     )
+    answer_hedge_timeout_sec: Optional[float] = Field(
+        default=None,  # Disabled
+        gt=0,
+    )  # If set, the other LLM is requested if the first token is not received before this delay
     answer_soft_timeout_sec: int = Field(
         default=30,  # 30 secs
         serialization_alias="intelligence_soft_timeout_sec",  # Compatibility with v7
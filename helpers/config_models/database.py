@@ -2,7 +2,7 @@ from enum import Enum
 from functools import lru_cache
 from typing import Optional
 
-from pydantic import BaseModel, SecretStr, ValidationInfo, field_validator
+from pydantic import BaseModel, Field, SecretStr, ValidationInfo, field_validator
 
 from persistence.istore import IStore
 
@@ -30,7 +30,12 @@ class CosmosDbModel(BaseModel, frozen=True):
 
 class SqliteModel(BaseModel, frozen=True):
     path: str = ".local"
-    schema_version: int = 3
+    pool_size: int = Field(
+        default=4, ge=1
+    )  # Read connections, in addition to the write connection
+    schema_version: int = Field(
+        default=5, ge=1
+    )  # On upgrade, calls of the previous version are copied when the store is opened, blocking it until done
     table: str = "calls"
 
     def full_path(self) -> str:
@@ -55,6 +60,12 @@ class DatabaseModel(BaseModel):
     cosmos_db: Optional[CosmosDbModel] = None
     mode: ModeEnum = ModeEnum.SQLITE
     sqlite: Optional[SqliteModel] = SqliteModel()  # Object is fully defined by default
+    total_cache_ttl_sec: int = Field(
+        default=60, ge=1
+    )  # Staleness accepted on call totals, 1 min
+    write_behind_delay_sec: float = Field(
+        default=1, ge=0
+    )  # Merge back-to-back saves of a call within this delay, 0 to disable
 
     @field_validator("cosmos_db")
     @classmethod
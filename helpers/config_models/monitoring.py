@@ -1,6 +1,6 @@
 from enum import Enum
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class LoggingLevelEnum(str, Enum):
@@ -20,3 +20,6 @@ class LoggingModel(BaseModel):
 
 class MonitoringModel(BaseModel):
     logging: LoggingModel = LoggingModel()  # Object is fully defined by default
+    readiness_interval_sec: int = Field(
+        default=15, ge=1
+    )  # Run the readiness checks in background, probes are answered with the last result
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from datetime import datetime
 from functools import cached_property
@@ -8,8 +9,9 @@ from typing import Optional
 
 from azure.core.exceptions import HttpResponseError
 from openai.types.chat import ChatCompletionSystemMessageParam
-from pydantic import BaseModel, TypeAdapter
+from pydantic import BaseModel, PrivateAttr, TypeAdapter
 
+from helpers.config_models.conversation import LanguageEntryModel
 from models.call import CallStateModel
 from models.message import MessageModel
 from models.next import NextModel
@@ -492,6 +494,9 @@ class LlmModel(BaseModel):
 
 
 class TtsModel(BaseModel):
+    # Private fields
+    _catalog: dict[tuple[str, str], str] = PrivateAttr(default_factory=dict)
+    # Configurable fields
     tts_lang: str = "en-US"
     calltransfer_failure_tpl: str = (
         "It seems I can't connect you with an agent at the moment, but the next available agent will call you back as soon as possible."
@@ -565,8 +570,71 @@ class TtsModel(BaseModel):
         return await self._translate(self.timeout_loading_tpl, call)
 
     async def ivr_language(self, call: CallStateModel) -> str:
+        return await self._translate(
+            self._ivr_language_prompt(call.initiate.lang.availables), call
+        )
+
+    async def awarm(self) -> None:
+        """
+        Translate the prompts of the default conversation, for all the available languages.
+
+        Translations are kept in memory, so the calls do not wait for the cache or the translation service. Prompts of other bot names or companies are translated on first use. If enabled, translated prompts are also pre-synthesized to audio files.
+        """
+        from helpers.config import CONFIG  # pylint: disable=import-outside-toplevel
+
+        initiate = CONFIG.conversation.initiate
+        kwargs = {
+            "bot_company": initiate.bot_company,
+            "bot_name": initiate.bot_name,
+            "conversation_timeout_hour": CONFIG.conversation.callback_timeout_hour,
+        }
+        prompts = [
+            self._return(prompt_tpl, **kwargs)
+            for prompt_tpl in [
+                self.calltransfer_failure_tpl,
+                self.connect_agent_tpl,
+                self.end_call_to_connect_agent_tpl,
+                self.error_tpl,
+                self.goodbye_tpl,
+                self.hello_tpl,
+                self.timeout_loading_tpl,
+                self.timeout_silence_tpl,
+                self.welcome_back_tpl,
+            ]
+        ] + [self._ivr_language_prompt(initiate.lang.availables)]
+        await asyncio.gather(
+            *[self._awarm_lang(lang, prompts) for lang in initiate.lang.availables]
+        )
+        self.logger.info(
+            "Translated %s TTS prompts for %s languages",
+            len(prompts),
+            len(initiate.lang.availables),
+        )
+
+    async def _awarm_lang(self, lang: LanguageEntryModel, prompts: list[str]) -> None:
+        """
+        Translate the prompts to a language, then pre-synthesize them with its voice.
+        """
+        from helpers.call_utils import (  # pylint: disable=import-outside-toplevel
+            audio_awarm,
+        )
+        from helpers.config import CONFIG  # pylint: disable=import-outside-toplevel
+
+        texts = await asyncio.gather(
+            *[self._translate_prompt(prompt, lang.short_code) for prompt in prompts]
+        )
+        await audio_awarm(
+            lang=lang,
+            prosody_rate=CONFIG.conversation.initiate.prosody_rate,
+            texts=texts,
+        )
+
+    def _ivr_language_prompt(self, availables: list[LanguageEntryModel]) -> str:
+        """
+        Build the language selection prompt, from the available languages.
+        """
         res = ""
-        for i, lang in enumerate(call.initiate.lang.availables):
+        for i, lang in enumerate(availables):
             res += (
                 self._return(
                     self.ivr_language_tpl,
@@ -575,7 +643,7 @@ class TtsModel(BaseModel):
                 )
                 + " "
             )
-        return await self._translate(res.strip(), call)
+        return res.strip()
 
     def _return(self, prompt_tpl: str, **kwargs) -> str:
         """
@@ -589,20 +657,38 @@ class TtsModel(BaseModel):
 
         If the translation fails, the initial prompt is returned.
         """
+        return await self._translate_prompt(
+            self._return(prompt_tpl, **kwargs), call.lang.short_code
+        )
+
+    async def _translate_prompt(self, initial: str, lang: str) -> str:
+        """
+        Translate a formatted prompt, using the in-memory catalog first.
+
+        If the translation fails, the initial prompt is returned, and not kept in the catalog.
+        """
         from helpers.translation import (  # pylint: disable=import-outside-toplevel
             translate_text,
         )
 
-        initial = self._return(prompt_tpl, **kwargs)
-        translation = None
+        # Try catalog
+        key = (initial, lang)
+        translation = self._catalog.get(key, None)
+        if translation:
+            return translation
+
+        # Try live
         try:
-            translation = await translate_text(
-                initial, self.tts_lang, call.lang.short_code
-            )
+            translation = await translate_text(initial, self.tts_lang, lang)
         except HttpResponseError as e:
             self.logger.warning("Failed to translate TTS prompt: %s", e)
-            pass
-        return translation or initial
+        if not translation:
+            return initial
+
+        # Update catalog, bounded as prompts can be formatted with custom bot names and companies
+        if len(self._catalog) < 1000:
+            self._catalog[key] = translation
+        return translation
 
     @cached_property
     def logger(self) -> Logger:
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import time
 from functools import lru_cache
 from os import environ
 from typing import AsyncGenerator, Callable, Optional, TypeVar, Union
@@ -30,6 +32,7 @@ from openai.types.chat.chat_completion_chunk import (
     ChoiceDeltaToolCallFunction,
 )
 from opentelemetry.instrumentation.openai import OpenAIInstrumentor
+from opentelemetry.metrics import CallbackOptions, Observation
 from pydantic import ValidationError
 from tenacity import (
     AsyncRetrying,
@@ -43,8 +46,9 @@ from tenacity import (
 from helpers.config import CONFIG
 from helpers.config_models.llm import AbstractPlatformModel as LlmAbstractPlatformModel
 from helpers.logging import logger
-from helpers.monitoring import tracer
+from helpers.monitoring import CallAttributes, meter, tracer
 from helpers.resources import resources_dir
+from models.call import CallStateModel, TokenLedger
 from models.message import MessageModel
 
 environ["TRACELOOP_TRACE_CONTENT"] = str(
@@ -54,6 +58,7 @@ OpenAIInstrumentor().instrument()  # Instrument OpenAI
 
 # tiktoken cache
 environ["TIKTOKEN_CACHE_DIR"] = resources_dir("tiktoken")
+_encodings: dict[str, tiktoken.Encoding] = {}
 
 logger.info(
     "Using LLM models %s (slow) and %s (fast)",
@@ -72,6 +77,42 @@ class MaximumTokensReachedError(Exception):
     pass
 
 
+_llm_completion_tokens = meter.create_histogram(
+    description="Number of tokens generated by the LLM.",
+    name="llm.completion_tokens",
+    unit="{token}",
+)
+_llm_generation_duration = meter.create_histogram(
+    description="Total duration of the LLM request, from the request to the last token.",
+    name="llm.generation_duration",
+    unit="s",
+)
+_llm_inter_token_gap = meter.create_histogram(
+    description="Duration between two tokens received from the LLM.",
+    name="llm.inter_token_gap",
+    unit="s",
+)
+_llm_prompt_tokens = meter.create_histogram(
+    description="Number of tokens sent to the LLM.",
+    name="llm.prompt_tokens",
+    unit="{token}",
+)
+_llm_retries = meter.create_histogram(
+    description="Number of retries before the LLM request succeeded.",
+    name="llm.retries",
+    unit="{retry}",
+)
+_llm_time_to_first_token = meter.create_histogram(
+    description="Duration between the LLM request and the first token received.",
+    name="llm.time_to_first_token",
+    unit="s",
+)
+_llm_tokens_per_second = meter.create_histogram(
+    description="Generation speed of the LLM, after the first token.",
+    name="llm.tokens_per_second",
+    unit="{token}/s",
+)
+
 _retried_exceptions = [
     APIConnectionError,
     APIResponseValidationError,
@@ -82,8 +123,8 @@ _retried_exceptions = [
 
 @tracer.start_as_current_span("llm_completion_stream")
 async def completion_stream(
+    call: CallStateModel,
     max_tokens: int,
-    messages: list[MessageModel],
     system: list[ChatCompletionSystemMessageParam],
     tools: Optional[list[ChatCompletionToolParam]] = None,
 ) -> AsyncGenerator[ChoiceDelta, None]:
@@ -91,6 +132,8 @@ async def completion_stream(
     Returns a stream of completions.
 
     Completion is first made with the fast LLM, then the slow LLM if the previous fails. Catch errors for a maximum of 3 times (internal + `RateLimitError`). If it fails again, raise the error.
+
+    If hedging is enabled, the first attempt races both LLMs (see `_completion_stream_hedged`).
     """
     retryed = AsyncRetrying(
         reraise=True,
@@ -101,14 +144,36 @@ async def completion_stream(
         wait=wait_random_exponential(multiplier=0.8, max=8),
     )
 
+    # Try first with both LLMs, if enabled
+    hedge_timeout_sec = CONFIG.conversation.answer_hedge_timeout_sec
+    if hedge_timeout_sec:
+        try:
+            async for chunck in _completion_stream_hedged(
+                call=call,
+                hedge_timeout_sec=hedge_timeout_sec,
+                max_tokens=max_tokens,
+                system=system,
+                tools=tools,
+            ):
+                yield chunck
+            return
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if not any(isinstance(e, exception) for exception in _retried_exceptions):
+                raise e
+            logger.warning(
+                "%s error while hedging, trying with retries",
+                e.__class__.__name__,
+            )
+
     # Try first with primary LLM
     try:
         async for attempt in retryed:
             with attempt:
                 async for chunck in _completion_stream_worker(
+                    call=call,
                     is_fast=not CONFIG.conversation.slow_llm_for_chat,  # Let configuration decide
                     max_tokens=max_tokens,
-                    messages=messages,
+                    retries=attempt.retry_state.attempt_number - 1,
                     system=system,
                     tools=tools,
                 ):
@@ -126,37 +191,164 @@ async def completion_stream(
     async for attempt in retryed:
         with attempt:
             async for chunck in _completion_stream_worker(
+                call=call,
                 is_fast=CONFIG.conversation.slow_llm_for_chat,  # Let configuration decide
                 max_tokens=max_tokens,
-                messages=messages,
+                retries=attempt.retry_state.attempt_number - 1,
                 system=system,
                 tools=tools,
             ):
                 yield chunck
 
 
+async def _completion_stream_hedged(
+    call: CallStateModel,
+    hedge_timeout_sec: float,
+    max_tokens: int,
+    system: list[ChatCompletionSystemMessageParam],
+    tools: Optional[list[ChatCompletionToolParam]] = None,
+) -> AsyncGenerator[ChoiceDelta, None]:
+    """
+    Returns a stream of completions, racing both LLMs.
+
+    Completion is first made with the primary LLM. If its first token is not received before the hedge timeout, or if it fails before, the same request is sent to the other LLM. The first LLM to answer is streamed, the other is cancelled. Errors are raised when both LLMs failed.
+
+    Each LLM stream is consumed by its own task, from start to end, and forwarded with a queue. Generators are never shared across tasks, so the tracing context stays consistent.
+    """
+    is_fast = not CONFIG.conversation.slow_llm_for_chat  # Let configuration decide
+    loop = asyncio.get_running_loop()
+    # Pending first chunk, with the stream task and queue of each LLM
+    getters: dict[
+        asyncio.Task,
+        tuple[asyncio.Task, asyncio.Queue[Union[ChoiceDelta, Exception, None]]],
+    ] = {}
+    streams: list[asyncio.Task] = []
+
+    async def _stream(
+        is_fast: bool,
+        queue: asyncio.Queue[Union[ChoiceDelta, Exception, None]],
+        retries: int,
+    ) -> None:
+        try:
+            async for chunck in _completion_stream_worker(
+                call=call,
+                is_fast=is_fast,
+                max_tokens=max_tokens,
+                retries=retries,
+                system=system,
+                tools=tools,
+            ):
+                await queue.put(chunck)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            await queue.put(e)
+            return
+        await queue.put(None)  # End of stream
+
+    def _start(is_fast: bool) -> None:
+        queue: asyncio.Queue[Union[ChoiceDelta, Exception, None]] = asyncio.Queue()
+        stream = asyncio.create_task(
+            _stream(
+                is_fast=is_fast,
+                queue=queue,
+                retries=len(streams),  # The hedge is a second attempt
+            )
+        )
+        streams.append(stream)
+        getters[asyncio.create_task(queue.get())] = (stream, queue)
+
+    try:
+        # Start with primary LLM, then hedge with the other if too slow or failed
+        _start(is_fast)
+        deadline = loop.time() + hedge_timeout_sec
+        hedged = False
+        winner: Optional[asyncio.Queue[Union[ChoiceDelta, Exception, None]]] = None
+        first: Union[ChoiceDelta, Exception, None] = None
+        error: Optional[Exception] = None
+        while getters and not winner:
+            done, _ = await asyncio.wait(
+                getters.keys(),
+                return_when=asyncio.FIRST_COMPLETED,
+                timeout=None if hedged else max(0, deadline - loop.time()),
+            )
+            if not done:
+                logger.info(
+                    "No answer after %ss, hedging with the other LLM backend",
+                    hedge_timeout_sec,
+                )
+                hedged = True
+                _start(not is_fast)
+                continue
+            for getter in done:
+                _, queue = getters.pop(getter)
+                first = getter.result()
+                if isinstance(first, Exception):
+                    if not any(
+                        isinstance(first, exception)
+                        for exception in _retried_exceptions
+                    ):
+                        raise first
+                    logger.warning(
+                        "%s error while hedging, waiting for the other LLM backend",
+                        first.__class__.__name__,
+                    )
+                    error = first
+                    continue
+                winner = queue
+                break
+            if not winner and not hedged:  # Primary failed, hedge without waiting
+                hedged = True
+                _start(not is_fast)
+
+        # Cancel the loser
+        for getter, (stream, _) in getters.items():
+            getter.cancel()
+            stream.cancel()
+        await asyncio.gather(*getters.keys(), return_exceptions=True)
+
+        if not winner:
+            assert error
+            raise error
+
+        # Forward the winner
+        chunck = first
+        while chunck is not None:
+            if isinstance(chunck, Exception):
+                raise chunck
+            yield chunck
+            chunck = await winner.get()
+
+    finally:
+        for task in [*getters.keys(), *streams]:
+            task.cancel()
+        await asyncio.gather(*getters.keys(), *streams, return_exceptions=True)
+
+
 async def _completion_stream_worker(
+    call: CallStateModel,
     is_fast: bool,
     max_tokens: int,
-    messages: list[MessageModel],
     system: list[ChatCompletionSystemMessageParam],
+    retries: int = 0,
     tools: Optional[list[ChatCompletionToolParam]] = None,
 ) -> AsyncGenerator[ChoiceDelta, None]:
     """
     Returns a stream of completions.
+
+    Metrics are recorded for each successful stream: time to first token, inter-token gaps, generation duration, tokens per second, prompt and completion tokens, and retries. They are tagged with the call ID and the LLM backend.
     """
     client, platform = _use_llm(is_fast)
     extra = {}
     if tools:
         extra["tools"] = tools  # Add tools if any
 
-    prompt = _limit_messages(
+    prompt, prompt_tokens = _limit_messages(
         context_window=platform.context,
         max_messages=20,  # Quick response
         max_tokens=max_tokens,
-        messages=messages,
+        messages=call.messages,
         model=platform.model,
         system=system,
+        token_ledger=call.token_ledger,
         tools=tools,
     )  # Limit to 20 messages for quick response and avoid hallucinations
     chat_kwargs = {
@@ -169,6 +361,35 @@ async def _completion_stream_worker(
     }  # Shared kwargs for both streaming and non-streaming
     maximum_tokens_reached = False
 
+    # Metrics
+    attributes = {
+        CallAttributes.CALL_ID: str(call.call_id),
+        "llm.backend": "fast" if is_fast else "slow",
+        "llm.model": platform.model,
+    }
+    completion: list[str] = []  # Generated text, to count the tokens at the end
+    completion_tokens: Optional[int] = None  # Exact value, if returned by the API
+    deltas = 0
+    first_token_at: Optional[float] = None
+    last_token_at: Optional[float] = None
+    start_at = time.monotonic()
+
+    def _on_delta(delta: ChoiceDelta) -> None:
+        nonlocal deltas, first_token_at, last_token_at
+        now = time.monotonic()
+        if first_token_at is None:
+            first_token_at = now
+            _llm_time_to_first_token.record(now - start_at, attributes)
+        if last_token_at is not None:
+            _llm_inter_token_gap.record(now - last_token_at, attributes)
+        last_token_at = now
+        deltas += 1
+        completion.append(delta.content or "")
+        for tool_call in delta.tool_calls or []:
+            if tool_call.function:
+                completion.append(tool_call.function.name or "")
+                completion.append(tool_call.function.arguments or "")
+
     try:
         if platform.streaming:  # Streaming
             stream: AsyncStream[ChatCompletionChunk] = (
@@ -178,6 +399,9 @@ async def _completion_stream_worker(
                 )
             )
             async for chunck in stream:
+                if chunck.usage:  # Use exact values when available
+                    completion_tokens = chunck.usage.completion_tokens
+                    prompt_tokens = chunck.usage.prompt_tokens
                 choices = chunck.choices
                 if (
                     not choices
@@ -195,13 +419,12 @@ async def _completion_stream_worker(
                     )
                     maximum_tokens_reached = True
                 if delta:
+                    _on_delta(delta)
                     yield delta
 
         else:  # Non-streaming, emulate streaming with a single completion
-            completion: ChatCompletion = await client.chat.completions.create(
-                **chat_kwargs
-            )
-            choice = completion.choices[0]
+            res: ChatCompletion = await client.chat.completions.create(**chat_kwargs)
+            choice = res.choices[0]
             if choice.finish_reason == "content_filter":  # Azure OpenAI content filter
                 raise SafetyCheckError(
                     f"Issue detected in generation: {choice.message.content}"
@@ -226,12 +449,29 @@ async def _completion_stream_worker(
                     for tool in message.tool_calls or []
                 ],
             )
+            _on_delta(delta)
+            if res.usage:  # Use exact values when available
+                completion_tokens = res.usage.completion_tokens
+                prompt_tokens = res.usage.prompt_tokens
             yield delta
     except BadRequestError as e:
         if e.code == "content_filter":
             raise SafetyCheckError("Issue detected in prompt") from e
         raise e
 
+    # Record metrics
+    end_at = time.monotonic()
+    if completion_tokens is None:
+        completion_tokens = _count_tokens("".join(completion), platform.model)
+    _llm_completion_tokens.record(completion_tokens, attributes)
+    _llm_generation_duration.record(end_at - start_at, attributes)
+    _llm_prompt_tokens.record(prompt_tokens, attributes)
+    _llm_retries.record(retries, attributes)
+    if first_token_at and deltas > 1 and end_at > first_token_at:
+        _llm_tokens_per_second.record(
+            completion_tokens / (end_at - first_token_at), attributes
+        )
+
     if maximum_tokens_reached:
         raise MaximumTokensReachedError(f"Maximum tokens reached {max_tokens}")
 
@@ -317,7 +557,7 @@ async def _completion_sync_worker(
     if json_output:
         extra["response_format"] = {"type": "json_object"}
 
-    prompt = _limit_messages(
+    prompt, _ = _limit_messages(
         context_window=platform.context,
         max_tokens=max_tokens,
         messages=[],
@@ -370,22 +610,37 @@ def _limit_messages(
     model: str,
     system: list[ChatCompletionSystemMessageParam],
     max_messages: int = 1000,
+    token_ledger: Optional[TokenLedger] = None,
     tools: Optional[list[ChatCompletionToolParam]] = None,
-) -> list[
-    Union[
-        ChatCompletionAssistantMessageParam,
-        ChatCompletionSystemMessageParam,
-        ChatCompletionToolMessageParam,
-        ChatCompletionUserMessageParam,
-    ]
+) -> tuple[
+    list[
+        Union[
+            ChatCompletionAssistantMessageParam,
+            ChatCompletionSystemMessageParam,
+            ChatCompletionToolMessageParam,
+            ChatCompletionUserMessageParam,
+        ]
+    ],
+    int,
 ]:
     """
-    Returns a list of messages limited by the context size.
+    Returns a list of messages limited by the context size, and its number of tokens.
 
     The context size is the maximum number of tokens allowed by the model. The messages are selected from the newest to the oldest, until the context or the maximum number of messages is reached.
+
+    If a token ledger is provided, message counts are reused from it and only new or edited messages are tokenized.
     """
     max_tokens = max_tokens or 0  # Default
 
+    def _message_tokens(message: MessageModel) -> int:
+        return _count_tokens(
+            "".join([json.dumps(x) for x in message.to_openai()]),
+            model,
+        )
+
+    if token_ledger:  # Forget removed messages
+        token_ledger.truncate(len(messages))
+
     counter = 0
     max_context = context_window - max_tokens
     selected_messages = []
@@ -402,40 +657,84 @@ def _limit_messages(
         tokens += _count_tokens(json.dumps(tool), model)
 
     # Add user messages until the available context is reached, from the newest to the oldest
-    for message in messages[::-1]:
-        openai_message = message.to_openai()
-        new_tokens = _count_tokens(
-            "".join([json.dumps(x) for x in openai_message]),
-            model,
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if counter >= max_messages:
+            break
+        new_tokens = (
+            token_ledger.count(
+                counter=_message_tokens,
+                index=index,
+                message=message,
+                model=model,
+            )
+            if token_ledger
+            else _message_tokens(message)
         )
         if tokens + new_tokens >= max_context:
             break
-        if counter >= max_messages:
-            break
         counter += 1
-        selected_messages += openai_message[::-1]
+        selected_messages += message.to_openai()[::-1]
         tokens += new_tokens
 
     logger.info("Using %s/%s messages (%s tokens) as context", counter, total, tokens)
     return [
         *system,
         *selected_messages[::-1],
-    ]
+    ], tokens
 
 
-@lru_cache  # Cache results in memory as token count is done many times on the same content
+@lru_cache(
+    maxsize=1024
+)  # Cache results in memory as token count is done many times on the same content, bounded as keys are full prompts
 def _count_tokens(content: str, model: str) -> int:
     """
     Returns the number of tokens in the content, using the model's encoding.
+    """
+    return len(_use_encoding(model).encode(content))
+
+
+def _count_tokens_hits(_: CallbackOptions) -> list[Observation]:
+    return [Observation(_count_tokens.cache_info().hits)]
+
 
-    If the model is unknown to tiktoken, it uses the GPT-3.5 encoding.
+def _count_tokens_misses(_: CallbackOptions) -> list[Observation]:
+    return [Observation(_count_tokens.cache_info().misses)]
+
+
+meter.create_observable_counter(
+    callbacks=[_count_tokens_hits],
+    description="Token count cache hits.",
+    name="llm.token_count.cache.hits",
+)
+meter.create_observable_counter(
+    callbacks=[_count_tokens_misses],
+    description="Token count cache misses.",
+    name="llm.token_count.cache.misses",
+)
+
+
+def _use_encoding(model: str) -> tiktoken.Encoding:
     """
-    try:
-        encoding_name = tiktoken.encoding_name_for_model(model)
-    except KeyError:
-        encoding_name = tiktoken.encoding_name_for_model("gpt-3.5")
-        logger.debug("Unknown model %s, using %s encoding", model, encoding_name)
-    return len(tiktoken.get_encoding(encoding_name).encode(content))
+    Returns the tiktoken encoding of a model.
+
+    Object is cached for performance, and shared across calls. If the model is unknown to tiktoken, it uses the GPT-3.5 encoding.
+    """
+    encoding = _encodings.get(model, None)
+    if not encoding:
+        try:
+            encoding_name = tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            encoding_name = tiktoken.encoding_name_for_model("gpt-3.5-turbo")
+            logger.debug("Unknown model %s, using %s encoding", model, encoding_name)
+        encoding = tiktoken.get_encoding(encoding_name)
+        _encodings[model] = encoding
+    return encoding
+
+
+# Preload encodings at startup, loading them from disk takes time and would be paid by the first call otherwise
+for _is_fast in (False, True):
+    _use_encoding(CONFIG.llm.selected(_is_fast).model)
 
 
 def _use_llm(
@@ -1,7 +1,7 @@
 from os import environ
 
 from azure.monitor.opentelemetry import configure_azure_monitor
-from opentelemetry import trace
+from opentelemetry import metrics, trace
 from opentelemetry.instrumentation.aiohttp_client import AioHttpClientInstrumentor
 from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
 from opentelemetry.trace.span import INVALID_SPAN
@@ -24,6 +24,11 @@ tracer = trace.get_tracer(
     instrumenting_module_name="com.github.clemlesne.call-center-ai",
 )  # Create a tracer that will be used in the app
 
+meter = metrics.get_meter(
+    name="com.github.clemlesne.call-center-ai",
+    version=VERSION,
+)  # Create a meter that will be used in the app
+
 
 def span_attribute(key: str, value: AttributeValue) -> None:
     """
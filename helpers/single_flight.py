@@ -0,0 +1,45 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesce concurrent calls with the same key.
+
+    The first caller runs the function, the concurrent callers with the same key wait for it and share its result, or its exception. Once done, the next call runs the function again, this is not a cache.
+
+    See: https://pkg.go.dev/golang.org/x/sync/singleflight
+    """
+
+    _copy: Optional[Callable[[T], T]]
+    _flights: dict[Hashable, asyncio.Task[T]]
+
+    def __init__(self, copy: Optional[Callable[[T], T]] = None):
+        """
+        Create a single-flight group.
+
+        If `copy` is provided, it is applied to the result returned to each caller, so mutable results are not shared.
+        """
+        self._copy = copy
+        self._flights = {}
+
+    async def arun(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run the function, or wait for the concurrent run with the same key.
+
+        The run is not cancelled if a caller is cancelled, as other callers may wait for it.
+        """
+        flight = self._flights.get(key, None)
+        if not flight:
+            flight = asyncio.ensure_future(func())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._forget(key, flight))
+        res = await asyncio.shield(flight)
+        return self._copy(res) if self._copy and res is not None else res
+
+    def _forget(self, key: Hashable, flight: asyncio.Task[T]) -> None:
+        if self._flights.get(key, None) is flight:
+            self._flights.pop(key)
@@ -0,0 +1,145 @@
+from hashlib import sha256
+from typing import Optional
+
+from aiohttp import ClientError
+from azure.identity.aio import ManagedIdentityCredential
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from helpers.config import CONFIG
+from helpers.http import aiohttp_session
+from helpers.logging import logger
+from helpers.single_flight import SingleFlight
+
+# WAV, mono, 16-bit, 16 kHz, as supported by Communication Services file sources
+# See: https://learn.microsoft.com/en-us/azure/communication-services/how-tos/call-automation/play-action
+_OUTPUT_FORMAT = "riff-16khz-16bit-mono-pcm"
+_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+_cache = CONFIG.cache.instance()
+_credential: Optional[ManagedIdentityCredential] = None
+_synthesize_flight: SingleFlight[bool] = SingleFlight()
+
+
+def audio_key(ssml: str) -> str:
+    """
+    Build the key of an audio, from its SSML.
+
+    SSML contains the voice, language, style and prosody rate, so each combination has its own audio.
+    """
+    return sha256(ssml.encode()).hexdigest()
+
+
+async def audio_aget(key: str) -> Optional[bytes]:
+    """
+    Get a synthesized audio.
+
+    If the audio has been evicted from the cache, it is synthesized again, when its SSML is still cached.
+
+    Returns the WAV file, or `None` if it is not synthesized.
+    """
+    audio = await _cache.aget(_cache_key(key))
+    if audio:
+        return audio
+    ssml = await _cache.aget(_ssml_cache_key(key))
+    if ssml and await audio_asynthesize(key=key, ssml=ssml.decode()):
+        return await _cache.aget(_cache_key(key))
+    return None
+
+
+async def audio_aready(key: str) -> bool:
+    """
+    Check if an audio is synthesized and can be served.
+
+    The small SSML entry is tested instead of the audio, stored with it and used to synthesize it again if evicted, so the WAV file is not fetched.
+    """
+    return bool(await _cache.aget(_ssml_cache_key(key)))
+
+
+async def audio_asynthesize(key: str, ssml: str) -> bool:
+    """
+    Synthesize SSML to an audio file, and store it.
+
+    Concurrent syntheses of the same key share a single request. If already stored, the service is not called.
+
+    Returns `True` if the audio is available.
+    """
+    return await _synthesize_flight.arun(
+        key=key,
+        func=lambda: _audio_asynthesize_worker(key=key, ssml=ssml),
+    )
+
+
+async def _audio_asynthesize_worker(key: str, ssml: str) -> bool:
+    # Try cache
+    if await _cache.aget(_cache_key(key)):
+        return True
+
+    # Try live
+    try:
+        audio = await _synthesize(ssml)
+    except ClientError as e:
+        logger.warning("Failed to synthesize audio: %s", e)
+        return False
+
+    # Update cache, with the SSML to synthesize again if the audio is evicted
+    return await _cache.amset(
+        items={
+            _cache_key(key): audio,
+            _ssml_cache_key(key): ssml,
+        },
+        ttl_sec=CONFIG.cognitive_service.static_audio_ttl_sec,
+    )
+
+
+@retry(
+    reraise=True,
+    retry=retry_if_exception_type(ClientError),
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.8, max=8),
+)
+async def _synthesize(ssml: str) -> bytes:
+    """
+    Synthesize SSML with the Speech REST API.
+
+    Catch errors for a maximum of 3 times.
+
+    See: https://learn.microsoft.com/en-us/azure/ai-services/speech-service/rest-text-to-speech
+    """
+    token = await (await _use_credential()).get_token(_SCOPE)
+    session = await aiohttp_session()
+    async with session.post(
+        data=ssml.encode(),
+        headers={
+            "Accept-Encoding": "identity",  # Session does not decompress responses
+            "Authorization": f"Bearer {token.token}",
+            "Content-Type": "application/ssml+xml",
+            "User-Agent": "call-center-ai",
+            "X-Microsoft-OutputFormat": _OUTPUT_FORMAT,
+        },
+        raise_for_status=True,
+        url=f"{CONFIG.cognitive_service.endpoint.rstrip('/')}/tts/cognitiveservices/v1",
+    ) as res:
+        return await res.read()
+
+
+def _cache_key(key: str) -> str:
+    return f"{__name__}-audio-{key}"
+
+
+def _ssml_cache_key(key: str) -> str:
+    return f"{__name__}-ssml-{key}"
+
+
+async def _use_credential() -> ManagedIdentityCredential:
+    """
+    Generate the Azure credential, shared across requests.
+    """
+    global _credential  # pylint: disable=global-statement
+    if not isinstance(_credential, ManagedIdentityCredential):
+        _credential = ManagedIdentityCredential()
+    return _credential
@@ -0,0 +1,28 @@
+import re
+from typing import Optional
+
+from jinja2.ext import Extension
+
+_PRESERVED_R = re.compile(
+    r"(<(pre|textarea)\b.*?</\2>)", re.DOTALL | re.IGNORECASE
+)  # Whitespace is meaningful in these tags
+_LINE_SPACES_R = re.compile(r"[ \t]*\n\s*")  # Indentation and blank lines
+
+
+class WhitespaceExtension(Extension):
+    """
+    Strip the indentation and blank lines of templates, when they are loaded.
+
+    Minification is done once per template, instead of on each rendered page. Line breaks are kept, so inline scripts relying on them are not broken. Content of `pre` and `textarea` tags is left untouched.
+    """
+
+    def preprocess(
+        self, source: str, name: Optional[str], filename: Optional[str] = None
+    ) -> str:
+        parts = _PRESERVED_R.split(source)
+        # Split returns the text, then the two groups of each match
+        return "".join(
+            part if i % 3 else _LINE_SPACES_R.sub("\n", part)
+            for i, part in enumerate(parts)
+            if i % 3 != 2
+        )
@@ -1,3 +1,4 @@
+import asyncio
 from typing import Optional
 
 from azure.ai.translation.text.aio import TextTranslationClient
@@ -14,50 +15,218 @@ from tenacity import (
 from helpers.config import CONFIG
 from helpers.http import azure_transport
 from helpers.logging import logger
+from helpers.single_flight import SingleFlight
 
 logger.info("Using Translation %s", CONFIG.ai_translation.endpoint)
 
 _cache = CONFIG.cache.instance()
 _client = Optional[TextTranslationClient]
+_translate_flight: SingleFlight[Optional[str]] = SingleFlight()
+
+# Batching, limits from https://learn.microsoft.com/en-us/azure/ai-services/translator/service-limits
+_BATCH_MAX_CHARS = 50000
+_BATCH_MAX_TEXTS = 1000
+_batch_pending: list[tuple[str, str, str, asyncio.Future[Optional[str]]]] = []
+_batch_task: Optional[asyncio.Task] = None
 
 
-@retry(
-    reraise=True,
-    retry=retry_if_exception_type(HttpResponseError),
-    stop=stop_after_attempt(3),
-    wait=wait_random_exponential(multiplier=0.8, max=8),
-)
 async def translate_text(
     text: str, source_lang: str, target_lang: str
 ) -> Optional[str]:
     """
     Translate text from source language to target language.
 
-    Catch errors for a maximum of 3 times.
+    Concurrent translations of the same text share a single request, and translations requested together are sent in batches. Catch errors for a maximum of 3 times.
     """
     if source_lang == target_lang:  # No need to translate
         return text
 
-    # Try cache
-    cache_key = f"{__name__}-translate_text-{text}-{source_lang}-{target_lang}"
-    cached = await _cache.aget(cache_key)
-    if cached:
-        return cached.decode()
+    return await _translate_flight.arun(
+        key=(text, source_lang, target_lang),
+        func=lambda: _translate_text_worker(
+            source_lang=source_lang,
+            target_lang=target_lang,
+            text=text,
+        ),
+    )
+
+
+async def _translate_text_worker(
+    text: str, source_lang: str, target_lang: str
+) -> Optional[str]:
+    """
+    Queue the translation in the next batch, and wait for its result.
+
+    The batch is sent after a short delay, so translations requested in the same event-loop tick share a single request.
+    """
+    global _batch_task  # pylint: disable=global-statement
+    future: asyncio.Future[Optional[str]] = asyncio.get_running_loop().create_future()
+    _batch_pending.append((text, source_lang, target_lang, future))
+    if not _batch_task:
+        _batch_task = asyncio.create_task(_batch_flush())
+        _batch_task.add_done_callback(_batch_cancelled)
+    return await future
+
+
+async def _batch_flush() -> None:
+    """
+    Send the queued translations, after the batch delay.
+
+    Cached translations are answered first, in a single round trip. The others are grouped by source language and targets, then sent by chunks fitting the API limits. A failed chunk only fails its own callers. If the flush is cancelled, the callers are cancelled too, so none waits forever.
+    """
+    pending: list[tuple[str, str, str, asyncio.Future[Optional[str]]]] = []
+    try:
+        await asyncio.sleep(CONFIG.ai_translation.batch_delay_sec)
+        pending = _batch_take()
+
+        # Try cache
+        cache_keys = [
+            _cache_key(text, source_lang, target_lang)
+            for text, source_lang, target_lang, _ in pending
+        ]
+        cached = await _cache.amget(cache_keys)
+        groups: dict[tuple[str, frozenset[str]], list[str]] = {}
+        misses: dict[tuple[str, str], set[str]] = {}  # (text, source) -> targets
+        for (text, source_lang, target_lang, future), value in zip(pending, cached):
+            if value:
+                future.set_result(value.decode())
+                continue
+            misses.setdefault((text, source_lang), set()).add(target_lang)
+        for (text, source_lang), targets in misses.items():
+            groups.setdefault((source_lang, frozenset(targets)), []).append(text)
+
+        # Try live
+        batches = [
+            (source_lang, sorted(targets), chunk)
+            for (source_lang, targets), texts in groups.items()
+            for chunk in _batch_chunks(texts, len(targets))
+        ]
+        translations: dict[str, Optional[str]] = {}
+        errors: dict[str, BaseException] = {}
+        for (source_lang, target_langs, chunk), res in zip(
+            batches,
+            await asyncio.gather(
+                *[
+                    _translate_batch(
+                        source_lang=source_lang,
+                        target_langs=target_langs,
+                        texts=chunk,
+                    )
+                    for source_lang, target_langs, chunk in batches
+                ],
+                return_exceptions=True,
+            ),
+        ):
+            if isinstance(res, BaseException):  # Fail only the callers of this chunk
+                for text in chunk:
+                    for target_lang in target_langs:
+                        errors[_cache_key(text, source_lang, target_lang)] = res
+                continue
+            translations.update(res)
+
+        # Update cache
+        if translations:
+            await _cache.amset(
+                items=translations,
+                ttl_sec=CONFIG.ai_translation.cache_ttl_sec,
+            )
+
+        # Answer the callers
+        for text, source_lang, target_lang, future in pending:
+            if future.done():
+                continue
+            key = _cache_key(text, source_lang, target_lang)
+            if key in errors:
+                future.set_exception(errors[key])
+            else:
+                future.set_result(translations.get(key))
 
-    # Try live
-    translation: Optional[str] = None
+    except asyncio.CancelledError:  # Batch still queued is cancelled by the callback
+        for *_, future in pending:
+            future.cancel()
+        raise
+
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        for *_, future in pending:
+            if not future.done():
+                future.set_exception(e)
+
+
+def _batch_cancelled(task: asyncio.Task) -> None:
+    """
+    Cancel the callers of a flush cancelled before taking its batch, even before it started.
+    """
+    if task.cancelled() and task is _batch_task:
+        for *_, future in _batch_take():
+            future.cancel()
+
+
+def _batch_take() -> list[tuple[str, str, str, asyncio.Future[Optional[str]]]]:
+    """
+    Take the queued translations, next requests go to a new batch.
+    """
+    global _batch_task  # pylint: disable=global-statement
+    pending = _batch_pending.copy()
+    _batch_pending.clear()
+    _batch_task = None
+    return pending
+
+
+def _batch_chunks(texts: list[str], targets_count: int) -> list[list[str]]:
+    """
+    Split texts into chunks fitting the Translator request limits.
+
+    Characters are counted once per target language, as the service bills them this way. A single text over the limit is sent alone, to let the service answer with its own error.
+    """
+    chunks: list[list[str]] = []
+    chunk: list[str] = []
+    chunk_chars = 0
+    for text in texts:
+        text_chars = len(text) * targets_count
+        if chunk and (
+            len(chunk) >= _BATCH_MAX_TEXTS
+            or chunk_chars + text_chars > _BATCH_MAX_CHARS
+        ):
+            chunks.append(chunk)
+            chunk = []
+            chunk_chars = 0
+        chunk.append(text)
+        chunk_chars += text_chars
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+@retry(
+    reraise=True,
+    retry=retry_if_exception_type(HttpResponseError),
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.8, max=8),
+)
+async def _translate_batch(
+    source_lang: str, target_langs: list[str], texts: list[str]
+) -> dict[str, Optional[str]]:
+    """
+    Translate multiple texts to multiple languages, in a single request.
+
+    Returns the translations, by cache key. Catch errors for a maximum of 3 times.
+    """
     client = await _use_client()
     res: list[TranslatedTextItem] = await client.translate(
-        body=[text],
+        body=texts,
         from_language=source_lang,
-        to_language=[target_lang],
+        to_language=target_langs,
     )
-    translation = res[0].translations[0].text if res and res[0].translations else None
+    translations: dict[str, Optional[str]] = {}
+    for text, item in zip(texts, res):
+        # Translations are returned in the same order as the requested languages
+        for target_lang, translation in zip(target_langs, item.translations or []):
+            translations[_cache_key(text, source_lang, target_lang)] = translation.text
+    return translations
 
-    # Update cache
-    await _cache.aset(cache_key, translation)
 
-    return translation
+def _cache_key(text: str, source_lang: str, target_lang: str) -> str:
+    return f"{__name__}-translate_text-{text}-{source_lang}-{target_lang}"
 
 
 async def _use_client() -> TextTranslationClient:
@@ -1,8 +1,9 @@
-import asyncio
 import random
 import string
+import time
+from collections import OrderedDict
 from datetime import UTC, datetime, tzinfo
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 from uuid import UUID, uuid4
 
 from pydantic import BaseModel, Field, ValidationInfo, computed_field, field_validator
@@ -16,6 +17,15 @@ from models.reminder import ReminderModel
 from models.synthesis import SynthesisModel
 from models.training import TrainingModel
 
+# Trainings of the last messages, by call and language, so the next turn only searches the new messages
+_TRAININGS_MEMO_MAX_CALLS = 1000
+_trainings_memo: OrderedDict[
+    tuple[UUID, str], dict[str, tuple[float, Optional[list[TrainingModel]]]]
+] = OrderedDict()
+# Token counts of the messages, by call, so the next turns only tokenize the new messages
+_TOKEN_LEDGERS_MAX_CALLS = 1000
+_token_ledgers: OrderedDict[UUID, "TokenLedger"] = OrderedDict()
+
 
 class CallInitiateModel(WorkflowInitiateModel):
     phone_number: PhoneNumber
@@ -73,6 +83,107 @@ class CallGetModel(BaseModel):
         )
 
 
+class TokenLedger:
+    """
+    Per-call cache of message token counts.
+
+    Counts are stored by model and message index, along with a fingerprint of the message. Only appended or edited messages are tokenized again, so the prompt assembly cost is proportional to the new messages. Memory is bounded by the number of messages in the call.
+    """
+
+    _entries: dict[tuple[str, int], tuple[int, int]]
+    _length: int
+
+    def __init__(self) -> None:
+        self._entries = {}
+        self._length = 0
+
+    def count(
+        self,
+        counter: Callable[[MessageModel], int],
+        index: int,
+        message: MessageModel,
+        model: str,
+    ) -> int:
+        """
+        Get the token count of a message, using the counter only if the message is new or has changed.
+
+        Returns the number of tokens.
+        """
+        key = (model, index)
+        fingerprint = self._fingerprint(message)
+        entry = self._entries.get(key, None)
+        if entry and entry[0] == fingerprint:
+            return entry[1]
+        tokens = counter(message)
+        self._entries[key] = (fingerprint, tokens)
+        self._length = max(self._length, index + 1)
+        return tokens
+
+    def truncate(self, length: int) -> None:
+        """
+        Forget the counts of messages removed from the history.
+        """
+        if length >= self._length:
+            return
+        for key in [key for key in self._entries if key[1] >= length]:
+            self._entries.pop(key)
+        self._length = length
+
+    @staticmethod
+    def _fingerprint(message: MessageModel) -> int:
+        """
+        Fingerprint the fields sent to the LLM.
+
+        Hashing is way cheaper than serializing and tokenizing the message.
+        """
+        return hash(
+            (
+                message.action,
+                message.content,
+                message.persona,
+                message.style,
+                tuple(
+                    (
+                        tool_call.content,
+                        tool_call.function_arguments,
+                        tool_call.function_name,
+                        tool_call.tool_id,
+                    )
+                    for tool_call in message.tool_calls
+                ),
+            )
+        )
+
+
+class CallListModel(BaseModel):
+    """
+    Call summary, for list views.
+
+    Fields are projected by the database, so messages are never loaded.
+    """
+
+    call_id: UUID
+    created_at: datetime
+    in_progress: bool
+    phone_number: PhoneNumber
+    synthesis: Optional[SynthesisModel] = None
+
+    def tz(self) -> tzinfo:
+        return PhoneNumber.tz(self.phone_number)
+
+
+class CallPageModel(BaseModel):
+    """
+    Page of calls.
+
+    `continuation` is an opaque token to get the next page, `None` on the last page. `total` is the count of all the calls matching the search, can be slightly outdated.
+    """
+
+    calls: list[CallListModel]
+    continuation: Optional[str] = None
+    total: int
+
+
 class CallStateModel(CallGetModel, extra="ignore"):
     # Immutable fields
     callback_secret: str = Field(
@@ -108,32 +219,74 @@ class CallStateModel(CallGetModel, extra="ignore"):
     def lang(self, short_code: str) -> None:
         self.lang_short_code = short_code
 
+    @property
+    def token_ledger(self) -> TokenLedger:
+        """
+        Token counts of the messages.
+
+        Ledger is kept in memory by call ID, so it survives the call state being reloaded on each event. It is not persisted, a call handled by another instance starts with an empty ledger.
+        """
+        ledger = _token_ledgers.pop(self.call_id, None) or TokenLedger()
+        # Update memo, least recently used calls are removed first
+        _token_ledgers[self.call_id] = ledger
+        while len(_token_ledgers) > _TOKEN_LEDGERS_MAX_CALLS:
+            _token_ledgers.popitem(last=False)
+        return ledger
+
     async def trainings(self, cache_only: bool = True) -> list[TrainingModel]:
         """
         Get the trainings from the last messages.
 
         Is using query expansion from last messages. Then, data is sorted by score.
+
+        Results of the previous turn are kept in memory, for the cache TTL, so only the new messages are searched. Cache misses are not kept, to be found once populated.
         """
         from helpers.config import CONFIG  # pylint: disable=import-outside-toplevel
 
         with tracer.start_as_current_span("call_trainings"):
-            search = CONFIG.ai_search.instance()
-            tasks = await asyncio.gather(
-                *[
-                    search.training_asearch_all(
-                        cache_only=cache_only,
-                        lang=self.lang.short_code,
-                        text=message.content,
-                    )
+            lang = self.lang.short_code
+            texts = list(
+                dict.fromkeys(
+                    message.content
                     for message in self.messages[
                         -CONFIG.ai_search.expansion_n_messages :
                     ]
-                ],
+                )
             )  # Get trainings from last messages
+
+            # Keep the results of the messages still in the window
+            now = time.monotonic()
+            memo_key = (self.call_id, lang)
+            previous = _trainings_memo.pop(memo_key, {})
+            memo = {
+                text: previous[text]
+                for text in texts
+                if text in previous
+                and now - previous[text][0] < CONFIG.ai_search.cache_ttl_sec
+            }
+
+            # Search the new messages
+            misses = [text for text in texts if text not in memo]
+            if misses:
+                search = CONFIG.ai_search.instance()
+                results = await search.training_asearch_many(
+                    cache_only=cache_only,
+                    lang=lang,
+                    texts=misses,
+                )
+                for text, res in zip(misses, results):
+                    if res is not None or not cache_only:
+                        memo[text] = (now, res)
+
+            # Update memo, least recently used calls are removed first
+            _trainings_memo[memo_key] = memo
+            while len(_trainings_memo) > _TRAININGS_MEMO_MAX_CALLS:
+                _trainings_memo.popitem(last=False)
+
             trainings = sorted(
                 set(
                     training
-                    for trainings in tasks
+                    for _, trainings in memo.values()
                     for training in trainings or []
                     if training.score >= CONFIG.ai_search.strictness
                 )
@@ -1,5 +1,6 @@
+from datetime import datetime
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -10,10 +11,14 @@ class ReadinessEnum(str, Enum):
 
 
 class ReadinessCheckModel(BaseModel):
+    duration_ms: Optional[float] = None  # Latency of the check
     id: str
     status: ReadinessEnum
 
 
 class ReadinessModel(BaseModel):
+    checked_at: Optional[datetime] = (
+        None  # Date of the checks, served until the next run
+    )
     checks: List[ReadinessCheckModel]
     status: ReadinessEnum
@@ -1,3 +1,7 @@
+import asyncio
+import re
+import unicodedata
+from functools import partial
 from typing import Optional
 
 from azure.core.credentials import AzureKeyCredential
@@ -28,15 +32,19 @@ from tenacity import (
 from helpers.config_models.ai_search import AiSearchModel
 from helpers.http import azure_transport
 from helpers.logging import logger
+from helpers.single_flight import SingleFlight
 from models.readiness import ReadinessEnum
 from models.training import TrainingModel
 from persistence.icache import ICache
 from persistence.isearch import ISearch
 
+_QUERY_PUNCTUATION_R = re.compile(r"[^\w\s]")
+
 
 class AiSearchSearch(ISearch):
     _client: Optional[SearchClient] = None
     _config: AiSearchModel
+    _training_asearch_flight: SingleFlight[Optional[list[TrainingModel]]]
 
     def __init__(self, cache: ICache, config: AiSearchModel):
         super().__init__(cache)
@@ -46,6 +54,7 @@ class AiSearchSearch(ISearch):
             300 * config.top_n_documents * config.expansion_n_messages / 4,
         )
         self._config = config
+        self._training_asearch_flight = SingleFlight()
 
     async def areadiness(self) -> ReadinessEnum:
         """
@@ -65,35 +74,91 @@ class AiSearchSearch(ISearch):
             )
         return ReadinessEnum.FAIL
 
-    @retry(
-        reraise=True,
-        retry=retry_if_exception_type(ServiceResponseError),
-        stop=stop_after_attempt(3),
-        wait=wait_random_exponential(multiplier=0.8, max=8),
-    )
     async def training_asearch_all(
         self,
         lang: str,
         text: str,
         cache_only: bool = False,
     ) -> Optional[list[TrainingModel]]:
-        logger.debug('Searching training data for "%s"', text)
-        if not text:
-            return None
-
-        # Try cache
-        cache_key = f"{self.__class__.__name__}-training_asearch_all-v2-{text}"  # Cache sort method has been updated in v6, thus the v2
-        cached = await self._cache.aget(cache_key)
-        if cached:
+        return (
+            await self.training_asearch_many(
+                cache_only=cache_only,
+                lang=lang,
+                texts=[text],
+            )
+        )[0]
+
+    async def training_asearch_many(
+        self,
+        lang: str,
+        texts: list[str],
+        cache_only: bool = False,
+    ) -> list[Optional[list[TrainingModel]]]:
+        logger.debug("Searching training data for %s texts", len(texts))
+        # Group texts by normalized query, first text of each query is the one searched
+        queries: dict[str, str] = {}
+        for text in texts:
+            query = _normalize_query(text)
+            if query:
+                queries.setdefault(query, text)
+        results: dict[str, Optional[list[TrainingModel]]] = {}
+
+        # Try cache, in a single round trip
+        cache_keys = [self._cache_key_training(lang, query) for query in queries]
+        for query, cached in zip(queries, await self._cache.amget(cache_keys)):
+            if not cached:
+                continue
             try:
-                return TypeAdapter(list[TrainingModel]).validate_json(cached)
+                results[query] = TypeAdapter(list[TrainingModel]).validate_json(cached)
             except ValidationError as e:
                 logger.debug("Parsing error: %s", e.errors())
 
-        if cache_only:
-            return None
+        if not cache_only:
+            # Try live, in parallel
+            misses = [query for query in queries if query not in results]
+            lives = await asyncio.gather(
+                *[
+                    self._training_asearch_flight.arun(
+                        key=(lang, query),
+                        func=partial(
+                            self._training_asearch_live,
+                            lang=lang,
+                            text=queries[query],
+                        ),
+                    )
+                    for query in misses
+                ]
+            )  # Concurrent searches of the same query, from other calls, share a single request
+            results.update(zip(misses, lives))
+
+            # Update cache, in a single round trip
+            updates = {
+                self._cache_key_training(lang, query): TypeAdapter(
+                    list[TrainingModel]
+                ).dump_json(trainings)
+                for query, trainings in zip(misses, lives)
+                if trainings
+            }
+            if updates:
+                await self._cache.amset(
+                    items=updates,
+                    ttl_sec=self._config.cache_ttl_sec,
+                )
+
+        return [results.get(_normalize_query(text), None) for text in texts]
 
-        # Try live
+    @retry(
+        reraise=True,
+        retry=retry_if_exception_type(ServiceResponseError),
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(multiplier=0.8, max=8),
+    )
+    async def _training_asearch_live(
+        self,
+        lang: str,
+        text: str,
+    ) -> Optional[list[TrainingModel]]:
+        logger.debug('Searching live training data for "%s"', text)
         trainings: list[TrainingModel] = []
         try:
             async with await self._use_client() as client:
@@ -147,14 +212,11 @@ class AiSearchSearch(ISearch):
         except ServiceRequestError as e:
             logger.error("Error connecting to AI Search: %s", e)
 
-        # Update cache
-        if trainings:
-            await self._cache.aset(
-                cache_key, TypeAdapter(list[TrainingModel]).dump_json(trainings)
-            )
-
         return trainings or None
 
+    def _cache_key_training(self, lang: str, query: str) -> str:
+        return f"{self.__class__.__name__}-training_asearch_all-v3-{lang}-{query}"  # Queries are normalized and scoped by language since v3
+
     async def _use_client(self) -> SearchClient:
         if not self._client:
             self._client = SearchClient(
@@ -169,3 +231,14 @@ class AiSearchSearch(ISearch):
                 ),
             )
         return self._client
+
+
+def _normalize_query(text: str) -> str:
+    """
+    Normalize a search query, so texts differing only by case, punctuation or spacing share the same results.
+
+    Returns an empty string if nothing is left to search.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _QUERY_PUNCTUATION_R.sub(" ", text)  # Remove punctuation
+    return " ".join(text.split())  # Remove multiple spaces
@@ -0,0 +1,46 @@
+import zlib
+
+from helpers.config_models.cache import CodecEnum
+
+# Header of encoded payloads: magic byte, format version, codec
+# Magic byte never appears in an UTF-8 text (0xC0, 0xC1, and 0xF5 to 0xFF are invalid), so plain payloads (cached before codecs or too small to be compressed) are never mistaken for encoded ones
+_MAGIC = b"\xff"
+_VERSION = 1
+_CODEC_IDS = {
+    CodecEnum.ZLIB: 1,
+}
+_MIN_SIZE = 256  # Bytes, below this size compression costs more than it saves
+
+
+def encode(value: bytes, codec: CodecEnum) -> bytes:
+    """
+    Encode a cache payload with a codec.
+
+    Small payloads are kept as is. Returns the encoded payload, prefixed by a header.
+    """
+    if codec == CodecEnum.NONE or len(value) < _MIN_SIZE:
+        return value
+    return (
+        _MAGIC
+        + bytes((_VERSION, _CODEC_IDS[codec]))
+        + zlib.compress(
+            value,
+            level=1,  # Fastest, JSON is repetitive enough to be well compressed anyway
+        )
+    )
+
+
+def decode(payload: bytes) -> bytes:
+    """
+    Decode a cache payload, whatever the codec used to encode it.
+
+    Payloads without header are returned as is, so the codec can be changed without flushing the cache. Raises `ValueError` if the header is unknown.
+    """
+    if not payload.startswith(_MAGIC):
+        return payload
+    version, codec_id = payload[1], payload[2]
+    if version != _VERSION:
+        raise ValueError(f"Unknown cache payload version {version}")
+    if codec_id == _CODEC_IDS[CodecEnum.ZLIB]:
+        return zlib.decompress(payload[3:])
+    raise ValueError(f"Unknown cache payload codec {codec_id}")
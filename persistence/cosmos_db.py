@@ -1,9 +1,10 @@
-import asyncio
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, Optional
+from datetime import UTC, datetime
+from typing import Any, AsyncGenerator, Optional
 from uuid import UUID, uuid4
 
+from azure.core import MatchConditions
 from azure.cosmos import ConsistencyLevel
 from azure.cosmos.aio import ContainerProxy, CosmosClient
 from azure.cosmos.exceptions import CosmosHttpResponseError
@@ -13,13 +14,13 @@ from helpers.config import CONFIG
 from helpers.config_models.database import CosmosDbModel
 from helpers.http import azure_transport
 from helpers.logging import logger
-from models.call import CallStateModel
+from models.call import CallListModel, CallStateModel
 from models.readiness import ReadinessEnum
 from persistence.icache import ICache
-from persistence.istore import IStore
+from persistence.store import AbstractStore
 
 
-class CosmosDbStore(IStore):
+class CosmosDbStore(AbstractStore):
     _client: Optional[CosmosClient] = None
     _config: CosmosDbModel
 
@@ -85,7 +86,7 @@ class CosmosDbStore(IStore):
                     exist = True
         return exist
 
-    async def call_aget(self, call_id: UUID) -> Optional[CallStateModel]:
+    async def _call_aget(self, call_id: UUID) -> Optional[CallStateModel]:
         logger.debug("Loading call %s", call_id)
 
         # Try cache
@@ -97,6 +98,11 @@ class CosmosDbStore(IStore):
             except ValidationError as e:
                 logger.debug("Parsing error: %s", e.errors())
 
+        # Try pending writes
+        pending = self._pending_call(call_id)
+        if pending:
+            return pending
+
         # Try live
         call = None
         try:
@@ -117,41 +123,81 @@ class CosmosDbStore(IStore):
 
         # Update cache
         if call:
-            await self._cache.aset(cache_key, call.model_dump_json())
+            await self._cache.aset(
+                key=cache_key,
+                ttl_sec=self._cache_ttl_sec(),
+                value=call.model_dump_json(),
+            )
 
         return call
 
-    async def call_aset(self, call: CallStateModel) -> bool:
-        logger.debug("Saving call %s", call.call_id)
+    async def _call_aset_live(self, call: CallStateModel) -> bool:
+        """
+        Write the call, patching only the changed fields and messages.
 
-        # Update live
-        data = call.model_dump(mode="json", exclude_none=True)
-        data["id"] = str(call.call_id)  # CosmosDB requires an id field
+        Patches are conditioned to the ETag of the last write. If the last write is unknown, the document was modified by another instance, or the changes exceed the patch limits, the whole document is upserted.
+        """
+        data, delta, fingerprints, etag = self._call_delta(call)
+        if delta and not delta[0] and not delta[1]:  # Nothing changed
+            return True
         logger.debug("Saving call %s: %s", call.call_id, data)
-        res = False
         try:
             async with self._use_client() as db:
-                await db.upsert_item(body=data)
-            res = True
+                res = None
+                if delta:  # Patch the changes only
+                    operations = self._patch_operations(*delta)
+                    if len(operations) <= 10:  # Cosmos DB limit per patch
+                        try:
+                            res = await db.patch_item(
+                                etag=etag,
+                                item=str(call.call_id),
+                                match_condition=MatchConditions.IfNotModified,
+                                partition_key=call.initiate.phone_number,
+                                patch_operations=operations,
+                            )
+                        except CosmosHttpResponseError as e:
+                            if e.status_code != 412:  # Modified by another instance
+                                raise e
+                            logger.debug("ETag changed for call %s", call.call_id)
+                if not res:  # Upsert the whole document
+                    body = call.model_dump(mode="json", exclude_none=True)
+                    body["id"] = str(call.call_id)  # CosmosDB requires an id field
+                    res = await db.upsert_item(body=body)
+            self._call_delta_commit(
+                call_id=call.call_id,
+                fingerprints=fingerprints,
+                version=res.get("_etag", None),
+            )
+            return True
         except CosmosHttpResponseError as e:
             logger.error("Error accessing CosmosDB: %s", e)
+            self._call_delta_reset(call.call_id)  # State is unknown
+        return False
 
-        # Update cache
-        if res:
-            cache_key_id = self._cache_key_call_id(call.call_id)
-            await self._cache.aset(
-                cache_key_id, call.model_dump_json()
-            )  # Update for ID
-            cache_key_phone_number = self._cache_key_phone_number(
-                call.initiate.phone_number
-            )
-            await self._cache.adel(
-                cache_key_phone_number
-            )  # Invalidate for phone number because we don't know if it's the same call
+    @staticmethod
+    def _patch_operations(
+        fields: dict[str, Any], messages: dict[int, Any], messages_count: int
+    ) -> list[dict[str, Any]]:
+        """
+        Build the JSON Patch operations for the changed fields and messages.
 
-        return res
+        Messages already written are replaced, new ones are appended in order.
 
-    async def call_asearch_one(self, phone_number: str) -> Optional[CallStateModel]:
+        See: https://learn.microsoft.com/en-us/azure/cosmos-db/partial-document-update
+        """
+        return [
+            {"op": "set", "path": f"/{key}", "value": value}
+            for key, value in fields.items()
+        ] + [
+            (
+                {"op": "set", "path": f"/messages/{idx}", "value": message}
+                if idx < messages_count
+                else {"op": "add", "path": "/messages/-", "value": message}
+            )
+            for idx, message in sorted(messages.items())
+        ]
+
+    async def _call_asearch_one(self, phone_number: str) -> Optional[CallStateModel]:
         logger.debug("Loading last call for %s", phone_number)
 
         # Try cache
@@ -189,43 +235,53 @@ class CosmosDbStore(IStore):
 
         # Update cache
         if call:
-            await self._cache.aset(cache_key, call.model_dump_json())
+            await self._cache.aset(
+                key=cache_key,
+                ttl_sec=self._cache_ttl_sec(),
+                value=call.model_dump_json(),
+            )
 
         return call
 
-    async def call_asearch_all(
-        self,
-        count: int,
-        phone_number: Optional[str] = None,
-    ) -> tuple[Optional[list[CallStateModel]], int]:
-        logger.debug("Searching calls, for %s and count %s", phone_number, count)
-        # TODO: Cache results
-        calls, total = await asyncio.gather(
-            self._call_asearch_all_calls_worker(count, phone_number),
-            self._call_asearch_all_total_worker(phone_number),
-        )
-        return calls, total
-
-    async def _call_asearch_all_calls_worker(
+    async def _call_asearch_all_live(
         self,
+        after: Optional[list[Any]],
         count: int,
-        phone_number: Optional[str] = None,
-    ) -> Optional[list[CallStateModel]]:
-        calls: list[CallStateModel] = []
+        phone_number: Optional[str],
+    ) -> tuple[list[CallListModel], Optional[list[Any]]]:
+        calls: list[CallListModel] = []
+        last: Optional[list[Any]] = None
+        if after is not None and (
+            len(after) != 2 or not all(isinstance(value, str) for value in after)
+        ):
+            raise ValueError("Invalid continuation token")
         try:
             async with self._use_client() as db:
-                where_clause = (
-                    "WHERE STRINGEQUALS(c.initiate.phone_number, @phone_number, true) OR STRINGEQUALS(c.claim.policyholder_phone, @phone_number, true)"
-                    if phone_number
-                    else ""
-                )
+                conditions = []
+                if phone_number:
+                    conditions.append(
+                        "(STRINGEQUALS(c.initiate.phone_number, @phone_number, true) OR STRINGEQUALS(c.claim.policyholder_phone, @phone_number, true))"
+                    )
+                if after:  # Calls created at the same time are ordered by id
+                    conditions.append(
+                        "(c.created_at < @after_created_at OR (c.created_at = @after_created_at AND c.id < @after_id))"
+                    )
+                where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
                 items = db.query_items(
-                    query=f"SELECT * FROM c {where_clause} ORDER BY c.created_at DESC OFFSET 0 LIMIT @count",
+                    query=f"SELECT c.id, c.call_id, c.created_at, c.in_progress, c.initiate.phone_number, c.synthesis FROM c {where_clause} ORDER BY c.created_at DESC, c.id DESC OFFSET 0 LIMIT @count",
                     parameters=[
                         {
                             "name": "@phone_number",
                             "value": phone_number,
                         },
+                        {
+                            "name": "@after_created_at",
+                            "value": after[0] if after else None,
+                        },
+                        {
+                            "name": "@after_id",
+                            "value": after[1] if after else None,
+                        },
                         {
                             "name": "@count",
                             "value": count,
@@ -235,18 +291,83 @@ class CosmosDbStore(IStore):
                 async for raw in items:
                     if not raw:
                         continue
+                    last = [raw["created_at"], raw["id"]]
                     try:
-                        calls.append(CallStateModel.model_validate(raw))
+                        calls.append(CallListModel.model_validate(raw))
                     except ValidationError:
                         logger.debug("Parsing error", exc_info=True)
         except CosmosHttpResponseError:
             logger.error("Error accessing CosmosDB", exc_info=True)
-        return calls
+        return calls, last
 
-    async def _call_asearch_all_total_worker(
+    async def _call_aexport_live(
         self,
-        phone_number: Optional[str] = None,
-    ) -> int:
+        after: Optional[list[Any]],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> AsyncGenerator[tuple[CallStateModel, list[Any]], None]:
+        if after is not None and (
+            len(after) != 2 or not all(isinstance(value, str) for value in after)
+        ):
+            raise ValueError("Invalid continuation token")
+        conditions = []
+        if since:
+            conditions.append("c.created_at >= @since")
+        if until:
+            conditions.append("c.created_at < @until")
+        if after:  # Calls created at the same time are ordered by id
+            conditions.append(
+                "(c.created_at > @after_created_at OR (c.created_at = @after_created_at AND c.id > @after_id))"
+            )
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            async with self._use_client() as db:
+                items = db.query_items(
+                    query=f"SELECT * FROM c {where_clause} ORDER BY c.created_at ASC, c.id ASC",
+                    parameters=[
+                        {
+                            "name": "@after_created_at",
+                            "value": after[0] if after else None,
+                        },
+                        {
+                            "name": "@after_id",
+                            "value": after[1] if after else None,
+                        },
+                        {
+                            "name": "@since",
+                            "value": self._created_at_value(since) if since else None,
+                        },
+                        {
+                            "name": "@until",
+                            "value": self._created_at_value(until) if until else None,
+                        },
+                    ],
+                )  # Pages are fetched as items are consumed, with the query continuation
+                async for raw in items:
+                    if not raw:
+                        continue
+                    try:
+                        call = CallStateModel.model_validate(raw)
+                    except ValidationError:
+                        logger.debug("Parsing error", exc_info=True)
+                        continue
+                    yield call, [raw["created_at"], raw["id"]]
+        except CosmosHttpResponseError:
+            logger.error("Error accessing CosmosDB", exc_info=True)
+            raise  # A truncated export must not look complete
+
+    @staticmethod
+    def _created_at_value(created_at: datetime) -> str:
+        """
+        Format a date like the `created_at` field is serialized, to be compared as text.
+
+        Naive dates are considered as UTC.
+        """
+        if not created_at.tzinfo:
+            created_at = created_at.replace(tzinfo=UTC)
+        return created_at.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    async def _call_acount_live(self, phone_number: Optional[str]) -> int:
         total = 0
         try:
             async with self._use_client() as db:
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Optional, Union
 
@@ -19,10 +20,64 @@ class ICache(ABC):
 
     @abstractmethod
     @tracer.start_as_current_span("cache_aset")
-    async def aset(self, key: str, value: Union[str, bytes, None]) -> bool:
-        pass
+    async def aset(
+        self,
+        key: str,
+        value: Union[str, bytes, None],
+        ttl_sec: Optional[int] = None,
+    ) -> bool:
+        """
+        Set a value in the cache.
+
+        The item expires after `ttl_sec`, if provided. Otherwise, the backend default applies.
+        """
+
+    @abstractmethod
+    @tracer.start_as_current_span("cache_amget")
+    async def amget(self, keys: list[str]) -> list[Optional[bytes]]:
+        """
+        Get multiple values from the cache, in a single round trip.
+
+        Returns the values in the same order as `keys`, `None` for missing keys.
+        """
+
+    @abstractmethod
+    @tracer.start_as_current_span("cache_amset")
+    async def amset(
+        self,
+        items: dict[str, Union[str, bytes, None]],
+        ttl_sec: Optional[int] = None,
+    ) -> bool:
+        """
+        Set multiple values in the cache, in a single round trip.
+
+        All items expire after `ttl_sec`, if provided. Otherwise, the backend default applies.
+        """
 
     @abstractmethod
     @tracer.start_as_current_span("cache_adel")
     async def adel(self, key: str) -> bool:
         pass
+
+    @abstractmethod
+    @tracer.start_as_current_span("cache_apublish")
+    async def apublish(self, channel: str, message: str) -> bool:
+        """
+        Publish a message on a channel.
+
+        Message is received by the subscribers of all instances, including this one. Delivery is at most once, messages published while a subscriber is disconnected are lost.
+        """
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> asyncio.Queue[str]:
+        """
+        Subscribe to the messages of a channel.
+
+        Returns a queue receiving the messages, until `unsubscribe` is called.
+        """
+
+    @abstractmethod
+    def unsubscribe(self, channel: str, queue: asyncio.Queue[str]) -> None:
+        """
+        Stop receiving the messages of a channel in a queue.
+        """
@@ -27,3 +27,17 @@ class ISearch(ABC):
         cache_only: bool = False,
     ) -> Optional[list[TrainingModel]]:
         pass
+
+    @abstractmethod
+    @tracer.start_as_current_span("search_asearch_many")
+    async def training_asearch_many(
+        self,
+        lang: str,
+        texts: list[str],
+        cache_only: bool = False,
+    ) -> list[Optional[list[TrainingModel]]]:
+        """
+        Search trainings for multiple texts at once.
+
+        Texts are normalized, so the ones differing only by case, punctuation or spacing are searched once. Cache is queried in a single round trip, then missing texts are searched in parallel. Returns the results in the same order as `texts`.
+        """
@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from datetime import datetime
+from typing import AsyncGenerator, Optional
 from uuid import UUID
 
 from helpers.monitoring import tracer
-from models.call import CallStateModel
+from models.call import CallPageModel, CallStateModel
 from models.readiness import ReadinessEnum
 from persistence.icache import ICache
 
@@ -26,8 +27,21 @@ class IStore(ABC):
 
     @abstractmethod
     @tracer.start_as_current_span("store_call_aset")
-    async def call_aset(self, call: CallStateModel) -> bool:
-        pass
+    async def call_aset(self, call: CallStateModel, flush: bool = False) -> bool:
+        """
+        Save a call.
+
+        Use `flush` when the state must be in the DB when returning (e.g. hangup, or read by a search). Returns `True` if the save succeeded or is scheduled.
+        """
+
+    @abstractmethod
+    @tracer.start_as_current_span("store_call_aflush")
+    async def call_aflush(self, call_id: Optional[UUID] = None) -> bool:
+        """
+        Write the pending saves to the DB now.
+
+        If `call_id` is not provided, all the pending calls are written. Returns `True` if all writes succeeded.
+        """
 
     @abstractmethod
     @tracer.start_as_current_span("store_call_adel")
@@ -35,16 +49,34 @@ class IStore(ABC):
         pass
 
     @abstractmethod
-    @tracer.start_as_current_span("store_call_adel")
+    @tracer.start_as_current_span("store_call_asearch_all")
     async def call_asearch_all(
         self,
         count: int,
+        continuation: Optional[str] = None,
         phone_number: Optional[str] = None,
-    ) -> tuple[Optional[list[CallStateModel]], int]:
-        pass
+    ) -> CallPageModel:
+        """
+        List calls, most recent first, projected for list views.
+
+        `continuation` is the token returned with the previous page.
+
+        Raises `ValueError` if the continuation token is invalid.
+        """
+
+    @abstractmethod
+    async def call_aexport(
+        self,
+        continuation: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> AsyncGenerator[tuple[CallStateModel, str], None]:
+        """
+        Iterate over all the calls, oldest first, created in `[since, until)`.
 
-    def _cache_key_call_id(self, call_id: UUID) -> str:
-        return f"{self.__class__.__name__}-call_id-{call_id}"
+        Each call is yielded with the continuation token to resume after it.
 
-    def _cache_key_phone_number(self, phone_number: str) -> str:
-        return f"{self.__class__.__name__}-phone_number-{phone_number}"
+        Raises `ValueError` if the continuation token is invalid.
+        """
+        raise NotImplementedError
+        yield  # pylint: disable=unreachable # Async generator, like the implementations
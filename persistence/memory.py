@@ -1,31 +1,57 @@
+import asyncio
 import hashlib
+import time
 from collections import OrderedDict
 from typing import Optional, Union
 
 from helpers.config_models.cache import MemoryModel
 from helpers.logging import logger
+from helpers.monitoring import meter
 from models.readiness import ReadinessEnum
+from persistence.codec import decode, encode
 from persistence.icache import ICache
 
+_cache_evictions = meter.create_counter(
+    description="Number of items evicted from the memory cache, to respect its size limits.",
+    name="cache.memory.evictions",
+    unit="{item}",
+)
+_cache_hits = meter.create_counter(
+    description="Number of reads found in the memory cache.",
+    name="cache.memory.hits",
+    unit="{read}",
+)
+_cache_misses = meter.create_counter(
+    description="Number of reads not found, or expired, in the memory cache.",
+    name="cache.memory.misses",
+    unit="{read}",
+)
+
 
 class MemoryCache(ICache):
     """
     A simple in-memory cache.
 
-    Use the least recently used (LRU) policy to remove the oldest used items when the cache is full.
+    Use the least recently used (LRU) policy to remove the oldest used items when the cache is full, either by number of items or by size in bytes. Items expire after their TTL, checked when read.
 
     See: https://en.wikipedia.org/wiki/Cache_replacement_policies#Least_recently_used_(LRU)
     """
 
-    _cache: OrderedDict[str, Union[bytes, None]] = OrderedDict()
+    _cache: OrderedDict[str, tuple[Optional[bytes], Optional[float]]]
     _config: MemoryModel
+    _size_bytes: int
+    _subscribers: dict[str, set[asyncio.Queue[str]]]
 
     def __init__(self, config: MemoryModel):
         logger.warning(
-            "Using memory cache with %s size limit, memory usage can be high, prefer an external cache like Redis",
+            "Using memory cache with %s items and %s bytes size limit, memory usage can be high, prefer an external cache like Redis",
             config.max_size,
+            config.max_bytes,
         )
+        self._cache = OrderedDict()
         self._config = config
+        self._size_bytes = 0
+        self._subscribers = {}
 
     async def areadiness(self) -> ReadinessEnum:
         """
@@ -37,25 +63,68 @@ class MemoryCache(ICache):
         """
         Get a value from the cache.
 
-        If the key does not exist, return `None`.
+        If the key does not exist or is expired, return `None`. An empty value is returned as is.
         """
         sha_key = self._key_to_hash(key)
-        res = self._cache.get(sha_key, None)
-        if not res:
+        item = self._cache.get(sha_key, None)
+        if not item:
+            _cache_misses.add(1)
+            return None
+        value, expires_at = item
+        if expires_at and expires_at <= time.monotonic():  # Expired
+            self._remove(sha_key)
+            _cache_misses.add(1)
             return None
-        self._cache.move_to_end(sha_key, last=False)  # Move to first
-        return res
+        self._cache.move_to_end(sha_key)  # Mark as most recently used
+        _cache_hits.add(1)
+        return decode(value) if value else value
 
-    async def aset(self, key: str, value: Union[str, bytes, None]) -> bool:
+    async def aset(
+        self,
+        key: str,
+        value: Union[str, bytes, None],
+        ttl_sec: Optional[int] = None,
+    ) -> bool:
         """
         Set a value in the cache.
+
+        The item expires after `ttl_sec`, or after the configured default TTL. Least recently used items are evicted until the cache fits in its limits.
         """
         sha_key = self._key_to_hash(key)
-        if len(self._cache) >= self._config.max_size:
-            self._cache.popitem()  # Delete the last
-        # Add to first
-        self._cache[sha_key] = value.encode() if isinstance(value, str) else value
-        self._cache.move_to_end(sha_key, last=False)
+        value = value.encode() if isinstance(value, str) else value
+        value = encode(value, self._config.codec) if value else value
+        ttl_sec = ttl_sec or self._config.ttl_sec
+        if sha_key in self._cache:
+            self._remove(sha_key)
+        self._cache[sha_key] = (value, time.monotonic() + ttl_sec if ttl_sec else None)
+        self._size_bytes += self._item_size(sha_key, value)
+        # Evict the least recently used, never the item just added
+        while len(self._cache) > 1 and (
+            len(self._cache) > self._config.max_size
+            or self._size_bytes > self._config.max_bytes
+        ):
+            self._remove(next(iter(self._cache)))
+            _cache_evictions.add(1)
+        return True
+
+    async def amget(self, keys: list[str]) -> list[Optional[bytes]]:
+        """
+        Get multiple values from the cache.
+
+        Returns the values in the same order as `keys`, `None` for missing or expired keys.
+        """
+        return [await self.aget(key) for key in keys]
+
+    async def amset(
+        self,
+        items: dict[str, Union[str, bytes, None]],
+        ttl_sec: Optional[int] = None,
+    ) -> bool:
+        """
+        Set multiple values in the cache.
+        """
+        for key, value in items.items():
+            await self.aset(key=key, ttl_sec=ttl_sec, value=value)
         return True
 
     async def adel(self, key: str) -> bool:
@@ -64,9 +133,57 @@ class MemoryCache(ICache):
         """
         sha_key = self._key_to_hash(key)
         if sha_key in self._cache:
-            self._cache.pop(sha_key)
+            self._remove(sha_key)
+        return True
+
+    async def apublish(self, channel: str, message: str) -> bool:
+        """
+        Publish a message on a channel.
+
+        Messages are only delivered in this instance.
+        """
+        for queue in self._subscribers.get(channel, set()):
+            queue.put_nowait(message)
         return True
 
+    def subscribe(self, channel: str) -> asyncio.Queue[str]:
+        """
+        Subscribe to the messages of a channel.
+        """
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        self._subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue[str]) -> None:
+        """
+        Stop receiving the messages of a channel in a queue.
+        """
+        queues = self._subscribers.get(channel, set())
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(channel, None)
+
+    def clear(self) -> None:
+        """
+        Remove all the items.
+        """
+        self._cache.clear()
+        self._size_bytes = 0
+
+    def _remove(self, sha_key: str) -> None:
+        """
+        Remove an item and release its size.
+        """
+        value, _ = self._cache.pop(sha_key)
+        self._size_bytes -= self._item_size(sha_key, value)
+
+    @staticmethod
+    def _item_size(sha_key: str, value: Optional[bytes]) -> int:
+        """
+        Get the size in bytes of an item, as accounted by the budget.
+        """
+        return len(sha_key) + (len(value) if value else 0)
+
     @staticmethod
     def _key_to_hash(key: str) -> str:
         """
@@ -1,9 +1,11 @@
+import asyncio
 import hashlib
 from typing import Optional, Union
 from uuid import uuid4
 
 from opentelemetry.instrumentation.redis import RedisInstrumentor
 from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
 from redis.asyncio.retry import Retry
 from redis.backoff import ExponentialBackoff
 from redis.exceptions import BusyLoadingError, ConnectionError, RedisError
@@ -11,7 +13,9 @@ from redis.exceptions import BusyLoadingError, ConnectionError, RedisError
 from helpers.config_models.cache import RedisModel
 from helpers.logging import logger
 from models.readiness import ReadinessEnum
+from persistence.codec import decode, encode
 from persistence.icache import ICache
+from persistence.memory import MemoryCache
 
 # Instrument redis
 RedisInstrumentor().instrument()
@@ -20,8 +24,17 @@ _retry = Retry(backoff=ExponentialBackoff(), retries=3)
 
 
 class RedisCache(ICache):
+    _L1_CHANNEL = "cache-l1-invalidation"
+    _MESSAGES_CHANNEL = "cache-messages"
+
     _client: Redis
     _config: RedisModel
+    _instance_id: str
+    _l1: Optional[MemoryCache] = None
+    _l1_generation: int = 0  # Incremented on each in-process invalidation
+    _listen_task: Optional[asyncio.Task] = None
+    _listening: bool = False
+    _subscribers: dict[str, set[asyncio.Queue[str]]]
 
     def __init__(self, config: RedisModel):
         logger.info("Using Redis cache %s:%s", config.host, config.port)
@@ -44,6 +57,13 @@ class RedisCache(ICache):
             password=config.password.get_secret_value(),
         )  # Redis manage by itself a low level connection pool with asyncio, but be warning to not use a generator while consuming the connection, it will close it
 
+        # In-process cache and messages
+        self._instance_id = uuid4().hex
+        self._subscribers = {}
+        if config.l1:
+            logger.info("Using in-process cache in front of Redis")
+            self._l1 = MemoryCache(config.l1)
+
     async def areadiness(self) -> ReadinessEnum:
         """
         Check the readiness of the Redis cache.
@@ -76,48 +96,328 @@ class RedisCache(ICache):
         """
         Get a value from the cache.
 
-        If the key does not exist or if the key exists but the value is empty, return `None`.
+        If the key does not exist or if the key exists but the value is empty, return `None`. If enabled, the in-process cache is used first.
 
         Catch errors for a maximum of 3 times, then raise the error.
         """
         sha_key = self._key_to_hash(key)
+
+        # Try in-process
+        l1 = self._use_l1()
+        if l1:
+            res = await l1.aget(sha_key.hex())
+            if res is not None:
+                return res or None
+        generation = self._l1_generation
+
+        # Try Redis
         res = None
         try:
-            res = await self._client.get(sha_key)
+            if not l1:
+                res = await self._client.get(sha_key)
+                return decode(res) if res else res
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.get(sha_key)
+                pipe.ttl(sha_key)  # Do not keep it in-process longer than in Redis
+                res, ttl = await pipe.execute()
         except RedisError:
             logger.error("Error getting value", exc_info=True)
+            return None
+        res = decode(res) if res else res
+
+        # Update in-process, unless invalidated while reading as the value could be outdated
+        if self._l1_generation != generation:
+            return res
+        await l1.aset(
+            key=sha_key.hex(),
+            ttl_sec=self._l1_ttl_sec(ttl),
+            value=res or b"",  # Cache misses too, they are invalidated as well
+        )
+
         return res
 
-    async def aset(self, key: str, value: Union[str, bytes, None]) -> bool:
+    async def aset(
+        self,
+        key: str,
+        value: Union[str, bytes, None],
+        ttl_sec: Optional[int] = None,
+    ) -> bool:
         """
         Set a value in the cache.
 
-        If the value is `None`, set an empty string.
+        If the value is `None`, set an empty string. The key expires after `ttl_sec`, if provided.
 
         Catch errors for a maximum of 3 times, then raise the error.
         """
-        sha_key = self._key_to_hash(key)
+        return await self.amset(items={key: value}, ttl_sec=ttl_sec)
+
+    async def amget(self, keys: list[str]) -> list[Optional[bytes]]:
+        """
+        Get multiple values from the cache, with a single `MGET`.
+
+        Returns the values in the same order as `keys`, `None` for missing keys. If the key exists but the value is empty, return `None`. If enabled, only the keys missing from the in-process cache are requested.
+
+        Catch errors for a maximum of 3 times, then raise the error.
+        """
+        sha_keys = [self._key_to_hash(key) for key in keys]
+        res: list[Optional[bytes]] = [None] * len(keys)
+        misses = list(range(len(keys)))
+
+        # Try in-process
+        l1 = self._use_l1()
+        if l1:
+            cached = await l1.amget([sha_key.hex() for sha_key in sha_keys])
+            misses = [i for i, value in enumerate(cached) if value is None]
+            for i, value in enumerate(cached):
+                res[i] = value or None
+
+        if not misses:
+            return res
+        generation = self._l1_generation
+
+        # Try Redis
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.mget([sha_keys[i] for i in misses])
+                if l1:
+                    for i in misses:
+                        pipe.ttl(
+                            sha_keys[i]
+                        )  # Do not keep it in-process longer than in Redis
+                values, *ttls = await pipe.execute()
+        except RedisError:
+            logger.error("Error getting values", exc_info=True)
+            return res
+        values = [decode(value) if value else None for value in values]
+        for i, value in zip(misses, values):
+            res[i] = value
+
+        # Update in-process, unless invalidated while reading as the values could be outdated
+        if l1 and self._l1_generation == generation:
+            for i, value, ttl in zip(misses, values, ttls):
+                await l1.aset(
+                    key=sha_keys[i].hex(),
+                    ttl_sec=self._l1_ttl_sec(ttl),
+                    value=value
+                    or b"",  # Cache misses too, they are invalidated as well
+                )
+
+        return res
+
+    async def amset(
+        self,
+        items: dict[str, Union[str, bytes, None]],
+        ttl_sec: Optional[int] = None,
+    ) -> bool:
+        """
+        Set multiple values in the cache, with a single pipeline.
+
+        If a value is `None`, set an empty string. The keys expire after `ttl_sec`, if provided. If enabled, the in-process caches of the other instances are invalidated in the same pipeline.
+
+        Catch errors for a maximum of 3 times, then raise the error.
+        """
+        if not items:
+            return True
+        sha_items = {
+            self._key_to_hash(key): (
+                value.encode() if isinstance(value, str) else value or b""
+            )
+            for key, value in items.items()
+        }
+        l1 = self._use_l1()
         try:
-            await self._client.set(sha_key, value if value else "")
+            async with self._client.pipeline(
+                transaction=False  # Keys are independent, no need to block the server
+            ) as pipe:
+                for sha_key, value in sha_items.items():
+                    pipe.set(
+                        ex=ttl_sec,
+                        name=sha_key,
+                        value=encode(value, self._config.codec) if value else value,
+                    )
+                if l1:
+                    self._l1_invalidate(pipe, list(sha_items))
+                await pipe.execute()
         except RedisError:
-            logger.error("Error setting value", exc_info=True)
+            logger.error("Error setting values", exc_info=True)
+            if l1:  # State is unknown
+                self._l1_generation += 1
+                for sha_key in sha_items:
+                    await l1.adel(sha_key.hex())
             return False
+
+        # Update in-process
+        if l1:
+            self._l1_generation += 1  # Concurrent reads may have the previous values
+            await l1.amset(
+                items={sha_key.hex(): value for sha_key, value in sha_items.items()},
+                ttl_sec=ttl_sec,
+            )
+
         return True
 
     async def adel(self, key: str) -> bool:
         """
         Delete a value from the cache.
 
+        If enabled, the in-process caches of all instances are invalidated.
+
         Catch errors for a maximum of 3 times, then raise the error.
         """
         sha_key = self._key_to_hash(key)
+        l1 = self._use_l1()
         try:
-            await self._client.delete(sha_key)
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.delete(sha_key)
+                if l1:
+                    self._l1_invalidate(pipe, [sha_key])
+                await pipe.execute()
         except RedisError:
             logger.error("Error deleting value", exc_info=True)
             return False
+        finally:
+            if l1:  # Concurrent reads may have the previous value
+                self._l1_generation += 1
+                await l1.adel(sha_key.hex())
         return True
 
+    async def apublish(self, channel: str, message: str) -> bool:
+        """
+        Publish a message on a channel.
+
+        Subscribers of this instance are notified immediately, the other instances through Redis. All channels share a single Redis channel, so each instance uses a single connection to listen.
+
+        Catch errors for a maximum of 3 times, then raise the error.
+        """
+        hex_channel = self._key_to_hash(channel).hex()
+        self._dispatch(hex_channel, message)
+        try:
+            await self._client.publish(
+                self._MESSAGES_CHANNEL,
+                " ".join([self._instance_id, hex_channel, message]),
+            )
+        except RedisError:
+            logger.error("Error publishing message", exc_info=True)
+            return False
+        return True
+
+    def subscribe(self, channel: str) -> asyncio.Queue[str]:
+        """
+        Subscribe to the messages of a channel.
+
+        Listening is started on first use, as it requires a running event loop.
+        """
+        self._use_listener()
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        self._subscribers.setdefault(self._key_to_hash(channel).hex(), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue[str]) -> None:
+        """
+        Stop receiving the messages of a channel in a queue.
+        """
+        hex_channel = self._key_to_hash(channel).hex()
+        queues = self._subscribers.get(hex_channel, set())
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(hex_channel, None)
+
+    def _dispatch(self, hex_channel: str, message: str) -> None:
+        """
+        Deliver a message to the subscribers of this instance.
+        """
+        for queue in self._subscribers.get(hex_channel, set()):
+            queue.put_nowait(message)
+
+    def _use_l1(self) -> Optional[MemoryCache]:
+        """
+        Get the in-process cache, if enabled and coherent.
+
+        The cache is used only while listening to the invalidations, otherwise changes from other instances could be missed.
+        """
+        if not self._l1:
+            return None
+        self._use_listener()
+        return self._l1 if self._listening else None
+
+    def _use_listener(self) -> None:
+        """
+        Start listening to the other instances, if not already.
+
+        The task is started on first use, as it requires a running event loop.
+        """
+        if not self._listen_task:
+            self._listen_task = asyncio.create_task(self._listen())
+
+    @staticmethod
+    def _l1_ttl_sec(ttl: int) -> Optional[int]:
+        """
+        Convert a Redis TTL to an in-process TTL.
+
+        Redis returns `-1` if the key has no expiration, and `-2` if the key does not exist, in which cases the in-process default applies.
+        """
+        return max(ttl, 1) if ttl >= 0 else None
+
+    def _l1_invalidate(self, pipe: Pipeline, sha_keys: list[bytes]) -> None:
+        """
+        Queue the invalidation of keys for the other instances.
+
+        Message is formatted as `{instance_id} {key_1} {key_2} ...`, with hex keys.
+        """
+        pipe.publish(
+            self._L1_CHANNEL,
+            " ".join([self._instance_id, *[sha_key.hex() for sha_key in sha_keys]]),
+        )
+
+    async def _listen(self) -> None:
+        """
+        Listen to the invalidations and messages of the other instances, forever.
+
+        In-process cache is cleared when (re)subscribed, as invalidations may have been missed while disconnected.
+        """
+        channels = [self._MESSAGES_CHANNEL]
+        if self._l1:
+            channels.append(self._L1_CHANNEL)
+        while True:
+            try:
+                async with self._client.pubsub() as pubsub:
+                    await pubsub.subscribe(*channels)
+                    if self._l1:
+                        self._l1_generation += 1
+                        self._l1.clear()
+                    self._listening = True
+                    logger.debug("Subscribed to %s", channels)
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True,
+                            timeout=1,  # Lower than the socket timeout
+                        )
+                        if not message or message["type"] != "message":
+                            continue
+                        channel = message["channel"].decode()
+                        data: str = message["data"].decode()
+                        if channel == self._MESSAGES_CHANNEL:
+                            sender, hex_channel, content = data.split(" ", 2)
+                            if sender != self._instance_id:  # Already dispatched
+                                self._dispatch(hex_channel, content)
+                        elif self._l1:
+                            sender, *hex_keys = data.split(" ")
+                            if sender == self._instance_id:  # Own changes
+                                continue
+                            self._l1_generation += 1
+                            for hex_key in hex_keys:
+                                await self._l1.adel(hex_key)
+            except asyncio.CancelledError:
+                self._listening = False
+                raise
+            except Exception:  # pylint: disable=broad-exception-caught
+                self._listening = False
+                logger.warning(
+                    "Error listening to the other instances, retrying in 5 secs",
+                    exc_info=True,
+                )
+                await asyncio.sleep(5)
+
     @staticmethod
     def _key_to_hash(key: str) -> bytes:
         """
@@ -1,7 +1,9 @@
 import asyncio
+import json
 import os
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, Optional
+from datetime import UTC, datetime
+from typing import Any, AsyncGenerator, Optional, Union
 from uuid import UUID
 
 from aiosqlite import Connection, connect as sqlite_connect
@@ -11,19 +13,26 @@ from pydantic import ValidationError
 from helpers.config import CONFIG
 from helpers.config_models.database import SqliteModel
 from helpers.logging import logger
-from models.call import CallStateModel
+from models.call import CallListModel, CallStateModel
 from models.readiness import ReadinessEnum
 from persistence.icache import ICache
-from persistence.istore import IStore
+from persistence.store import AbstractStore
 
 # Instrument sqlite
 SQLite3Instrumentor().instrument()
 
 
-class SqliteStore(IStore):
+class SqliteStore(AbstractStore):
     _config: SqliteModel
+    _data_select: str
+    _list_select: str
     _db_path: str
     _first_run_done: bool
+    _init_lock: asyncio.Lock
+    _readers: asyncio.Queue[Connection]
+    _readers_count: int
+    _writer: Optional[Connection] = None
+    _writer_lock: asyncio.Lock
 
     def __init__(self, cache: ICache, config: SqliteModel):
         super().__init__(cache)
@@ -32,11 +41,20 @@ class SqliteStore(IStore):
         )
         self._config = config
 
+        # Reassemble the call with its messages, ordered by index
+        self._data_select = f"JSON_SET(data, '$.messages', (SELECT JSON_GROUP_ARRAY(JSON(m.data)) FROM (SELECT data FROM {config.table}_messages WHERE call_id = {config.table}.id ORDER BY idx) m))"
+        # Project the fields of the list views, without the messages
+        self._list_select = "JSON_OBJECT('call_id', id, 'created_at', JSON_EXTRACT(data, '$.created_at'), 'in_progress', JSON(CASE in_progress WHEN 0 THEN 'false' ELSE 'true' END), 'phone_number', phone_number, 'synthesis', JSON(JSON_EXTRACT(data, '$.synthesis')))"
+
         # Create folder if does not exist
         self._db_path = self._config.full_path()
 
         # Check if first run
         self._first_run_done = False
+        self._init_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._readers_count = 0
+        self._writer_lock = asyncio.Lock()
         if not os.path.isfile(self._db_path):
             db_folder = self._db_path[: self._db_path.rfind("/")]
             os.makedirs(name=db_folder, exist_ok=True)
@@ -56,23 +74,28 @@ class SqliteStore(IStore):
             logger.error("Unknown error while checking SQLite readiness", exc_info=True)
         return ReadinessEnum.FAIL
 
-    async def call_aget(self, call_id: UUID) -> Optional[CallStateModel]:
+    async def _call_aget(self, call_id: UUID) -> Optional[CallStateModel]:
         logger.debug("Loading call %s", call_id)
 
         # Try cache
         cache_key = self._cache_key_call_id(call_id)
-        call = await self._cache.aget(cache_key)
-        if call:
+        cached = await self._cache.aget(cache_key)
+        if cached:
             try:
-                return CallStateModel.model_validate_json(call)
+                return CallStateModel.model_validate_json(cached)
             except ValidationError:
                 logger.debug("Parsing error", exc_info=True)
 
+        # Try pending writes
+        pending = self._pending_call(call_id)
+        if pending:
+            return pending
+
         # Try live
         call = None
         async with self._use_db() as db:
             cursor = await db.execute(
-                f"SELECT data FROM {self._config.table} WHERE id = ?",
+                f"SELECT {self._data_select} FROM {self._config.table} WHERE id = ?",
                 (str(call_id),),
             )
             row = await cursor.fetchone()
@@ -84,39 +107,133 @@ class SqliteStore(IStore):
 
         # Update cache
         if call:
-            await self._cache.aset(cache_key, call.model_dump_json())
+            await self._cache.aset(
+                key=cache_key,
+                ttl_sec=self._cache_ttl_sec(),
+                value=call.model_dump_json(),
+            )
 
         return call
 
-    async def call_aset(self, call: CallStateModel) -> bool:
-        # TODO: Catch exceptions and return False if something goes wrong
+    async def _call_aset_live(self, call: CallStateModel) -> bool:
+        """
+        Write the call, with its messages in a separate table.
 
-        # Update live
-        data = call.model_dump_json(exclude_none=True)
-        logger.debug("Saving call %s: %s", call.call_id, data)
-        async with self._use_db() as db:
-            await db.execute(
-                f"INSERT OR REPLACE INTO {self._config.table} VALUES (?, ?)",
-                (
-                    str(call.call_id),  # id
-                    data,  # data
-                ),
-            )
+        Only the new or changed messages are written, the call row is small as it does not contain the messages. If the last write is unknown or the revision changed (written by another process), the whole call is written.
+        """
+        # TODO: Catch exceptions and return False if something goes wrong
+        data, delta, fingerprints, revision = self._call_delta(call)
+        if delta and not delta[0] and not delta[1]:  # Nothing changed
+            return True
+        call_id = str(call.call_id)
+        logger.debug("Saving call %s: %s", call_id, data)
+        async with self._use_db(write=True) as db:
+            if delta:  # Write the changes only
+                fields, messages, _ = delta
+                logger.debug(
+                    "Saving %s fields and %s messages", len(fields), len(messages)
+                )
+                columns = self._call_columns(call)
+                cursor = await db.execute(
+                    f"UPDATE {self._config.table} SET data = :data, revision = revision + 1, policyholder_phone = :policyholder_phone, in_progress = :in_progress WHERE id = :id AND revision = :revision",
+                    {
+                        "data": json.dumps(data),
+                        "id": call_id,
+                        "in_progress": columns["in_progress"],
+                        "policyholder_phone": columns["policyholder_phone"],
+                        "revision": revision,
+                    },
+                )
+                if cursor.rowcount == 1:
+                    revision += 1
+                    await db.executemany(
+                        f"INSERT OR REPLACE INTO {self._config.table}_messages VALUES (?, ?, ?)",
+                        [
+                            (
+                                call_id,  # call_id
+                                idx,  # idx
+                                json.dumps(message),  # data
+                            )
+                            for idx, message in messages.items()
+                        ],
+                    )
+                else:  # Written by another process, write the whole call
+                    logger.debug("Revision changed for call %s", call_id)
+                    delta = None
+            if not delta:  # Write the whole call
+                revision = await self._call_awrite(call=call, data=data, db=db)
             await db.commit()
+        self._call_delta_commit(
+            call_id=call.call_id,
+            fingerprints=fingerprints,
+            version=revision,
+        )
+        return True
 
-        # Update cache
-        cache_key_id = self._cache_key_call_id(call.call_id)
-        await self._cache.aset(cache_key_id, data)  # Update for ID
-        cache_key_phone_number = self._cache_key_phone_number(
-            call.initiate.phone_number
+    async def _call_awrite(
+        self, call: CallStateModel, data: dict[str, Any], db: Connection
+    ) -> Optional[int]:
+        """
+        Write the whole call, without committing.
+
+        Returns the new revision of the call.
+        """
+        call_id = str(call.call_id)
+        cursor = await db.execute(
+            f"INSERT INTO {self._config.table} (id, data, revision, phone_number, policyholder_phone, created_at, in_progress) VALUES (:id, :data, 1, :phone_number, :policyholder_phone, :created_at, :in_progress) ON CONFLICT (id) DO UPDATE SET data = excluded.data, revision = {self._config.table}.revision + 1, phone_number = excluded.phone_number, policyholder_phone = excluded.policyholder_phone, created_at = excluded.created_at, in_progress = excluded.in_progress RETURNING revision",
+            {
+                "data": json.dumps(data),
+                "id": call_id,
+                **self._call_columns(call),
+            },
         )
-        await self._cache.adel(
-            cache_key_phone_number
-        )  # Invalidate for phone number because we don't know if it's the same call
+        row = await cursor.fetchone()
+        await db.execute(
+            f"DELETE FROM {self._config.table}_messages WHERE call_id = ?",
+            (call_id,),
+        )
+        await db.executemany(
+            f"INSERT INTO {self._config.table}_messages VALUES (?, ?, ?)",
+            [
+                (
+                    call_id,  # call_id
+                    idx,  # idx
+                    message.model_dump_json(exclude_none=True),  # data
+                )
+                for idx, message in enumerate(call.messages)
+            ],
+        )
+        return row[0] if row else None
 
-        return True
+    @staticmethod
+    def _call_columns(call: CallStateModel) -> dict[str, Union[str, int, None]]:
+        """
+        Get the searchable columns of a call.
 
-    async def call_asearch_one(self, phone_number: str) -> Optional[CallStateModel]:
+        Returns the values by column name: the phone number, the policyholder phone, the creation date (UTC, sortable as text and comparable with `DATETIME`), and the in progress flag.
+        """
+        policyholder_phone = call.claim.get("policyholder_phone", None)
+        return {
+            "created_at": SqliteStore._created_at_column(call.created_at),
+            "in_progress": int(call.in_progress),
+            "phone_number": call.initiate.phone_number,
+            "policyholder_phone": (
+                str(policyholder_phone) if policyholder_phone else None
+            ),
+        }
+
+    @staticmethod
+    def _created_at_column(created_at: datetime) -> str:
+        """
+        Format a date for the `created_at` column, in UTC, sortable as text and comparable with `DATETIME`.
+
+        Naive dates are considered as UTC.
+        """
+        if not created_at.tzinfo:
+            created_at = created_at.replace(tzinfo=UTC)
+        return created_at.astimezone(UTC).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    async def _call_asearch_one(self, phone_number: str) -> Optional[CallStateModel]:
         logger.debug("Loading last call for %s", phone_number)
 
         # Try cache
@@ -132,10 +249,10 @@ class SqliteStore(IStore):
         call = None
         async with self._use_db() as db:
             cursor = await db.execute(
-                f"SELECT data FROM {self._config.table} WHERE (JSON_EXTRACT(data, '$.initiate.phone_number') LIKE ? OR JSON_EXTRACT(data, '$.claim.policyholder_phone') LIKE ?) AND DATETIME(JSON_EXTRACT(data, '$.created_at')) >= DATETIME('now', '-{CONFIG.conversation.callback_timeout_hour} hours') ORDER BY DATETIME(JSON_EXTRACT(data, '$.created_at')) DESC LIMIT 1",
+                f"SELECT {self._data_select} FROM {self._config.table} WHERE (phone_number = ? OR policyholder_phone = ?) AND created_at >= DATETIME('now', '-{CONFIG.conversation.callback_timeout_hour} hours') ORDER BY created_at DESC LIMIT 1",
                 (
-                    phone_number,  # data.initiate.phone_number
-                    phone_number,  # data.claim.policyholder_phone
+                    phone_number,  # phone_number
+                    phone_number,  # policyholder_phone
                 ),
             )
             row = await cursor.fetchone()
@@ -147,64 +264,98 @@ class SqliteStore(IStore):
 
         # Update cache
         if call:
-            await self._cache.aset(cache_key, call.model_dump_json())
+            await self._cache.aset(
+                key=cache_key,
+                ttl_sec=self._cache_ttl_sec(),
+                value=call.model_dump_json(),
+            )
 
         return call
 
-    async def call_asearch_all(
-        self,
-        count: int,
-        phone_number: Optional[str] = None,
-    ) -> tuple[Optional[list[CallStateModel]], int]:
-        logger.debug("Searching calls, for %s and count %s", phone_number, count)
-        # TODO: Cache results
-        calls, total = await asyncio.gather(
-            self._call_asearch_all_calls_worker(count, phone_number),
-            self._call_asearch_all_total_worker(phone_number),
-        )
-        return calls, total
-
-    async def _call_asearch_all_calls_worker(
+    async def _call_asearch_all_live(
         self,
+        after: Optional[list[Any]],
         count: int,
-        phone_number: Optional[str] = None,
-    ) -> Optional[list[CallStateModel]]:
-        calls: list[CallStateModel] = []
+        phone_number: Optional[str],
+    ) -> tuple[list[CallListModel], Optional[list[Any]]]:
+        calls: list[CallListModel] = []
+        last: Optional[list[Any]] = None
+        if after is not None and (
+            len(after) != 2 or not all(isinstance(value, str) for value in after)
+        ):
+            raise ValueError("Invalid continuation token")
         async with self._use_db() as db:
-            where_clause = (
-                "WHERE (JSON_EXTRACT(data, '$.initiate.phone_number') LIKE ? OR JSON_EXTRACT(data, '$.claim.policyholder_phone') LIKE ?)"
-                if phone_number
-                else ""
-            )
+            conditions = []
+            params: list[Any] = []
+            if phone_number:
+                conditions.append("(phone_number = ? OR policyholder_phone = ?)")
+                params += [
+                    phone_number,  # phone_number
+                    phone_number,  # policyholder_phone
+                ]
+            if after:
+                conditions.append("(created_at, id) < (?, ?)")
+                params += after  # created_at, id
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
             cursor = await db.execute(
-                f"SELECT data FROM {self._config.table} {where_clause} ORDER BY DATETIME(JSON_EXTRACT(data, '$.created_at')) DESC LIMIT ?",
+                f"SELECT {self._list_select}, created_at, id FROM {self._config.table} {where_clause} ORDER BY created_at DESC, id DESC LIMIT ?",
                 (
-                    (
-                        phone_number,  # data.initiate.phone_number
-                        phone_number,  # data.claim.policyholder_phone
-                        count,  # limit
-                    )
-                    if phone_number
-                    else (count,)  # limit
+                    *params,
+                    count,  # limit
                 ),
             )
             rows = await cursor.fetchall()
             for row in rows:
                 if not row:
                     continue
+                last = [row[1], row[2]]  # created_at, id
                 try:
-                    calls.append(CallStateModel.model_validate_json(row[0]))
+                    calls.append(CallListModel.model_validate_json(row[0]))
                 except ValidationError:
                     logger.debug("Parsing error", exc_info=True)
-        return calls
+        return calls, last
 
-    async def _call_asearch_all_total_worker(
+    async def _call_aexport_live(
         self,
-        phone_number: Optional[str] = None,
-    ) -> int:
+        after: Optional[list[Any]],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> AsyncGenerator[tuple[CallStateModel, list[Any]], None]:
+        if after is not None and (
+            len(after) != 2 or not all(isinstance(value, str) for value in after)
+        ):
+            raise ValueError("Invalid continuation token")
+        conditions = []
+        params: list[Any] = []
+        if since:
+            conditions.append("created_at >= ?")
+            params.append(self._created_at_column(since))
+        if until:
+            conditions.append("created_at < ?")
+            params.append(self._created_at_column(until))
+        if after:
+            conditions.append("(created_at, id) > (?, ?)")
+            params += after  # created_at, id
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        async with self._use_db() as db:
+            async with db.execute(
+                f"SELECT {self._data_select}, created_at, id FROM {self._config.table} {where_clause} ORDER BY created_at, id",
+                params,
+            ) as cursor:
+                async for (
+                    row
+                ) in cursor:  # Rows are fetched by batches of the cursor array size
+                    try:
+                        call = CallStateModel.model_validate_json(row[0])
+                    except ValidationError:
+                        logger.debug("Parsing error", exc_info=True)
+                        continue
+                    yield call, [row[1], row[2]]  # created_at, id
+
+    async def _call_acount_live(self, phone_number: Optional[str]) -> int:
         async with self._use_db() as db:
             where_clause = (
-                "WHERE (JSON_EXTRACT(data, '$.initiate.phone_number') LIKE ? OR JSON_EXTRACT(data, '$.claim.policyholder_phone') LIKE ?)"
+                "WHERE phone_number = ? OR policyholder_phone = ?"
                 if phone_number
                 else ""
             )
@@ -212,8 +363,8 @@ class SqliteStore(IStore):
                 f"SELECT COUNT(*) FROM {self._config.table} {where_clause}",
                 (
                     (
-                        phone_number,  # data.initiate.phone_number
-                        phone_number,  # data.claim.policyholder_phone
+                        phone_number,  # phone_number
+                        phone_number,  # policyholder_phone
                     )
                     if phone_number
                     else ()
@@ -229,34 +380,152 @@ class SqliteStore(IStore):
         See: https://sqlite.org/cgi/src/doc/wal2/doc/wal2.md
         """
         logger.info("First run, init database")
-        # Optimize performance for concurrent writes
-        await db.execute("PRAGMA journal_mode=WAL")
-        # Create table
+        # Create tables
         await db.execute(
-            f"CREATE TABLE IF NOT EXISTS {self._config.table} (id VARCHAR(36) PRIMARY KEY, data TEXT)"
+            f"CREATE TABLE IF NOT EXISTS {self._config.table} (id VARCHAR(36) PRIMARY KEY, data TEXT, revision INTEGER NOT NULL DEFAULT 0, phone_number TEXT NOT NULL, policyholder_phone TEXT, created_at TEXT NOT NULL, in_progress INTEGER NOT NULL DEFAULT 0)"
+        )
+        await db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._config.table}_messages (call_id VARCHAR(36), idx INTEGER, data TEXT, PRIMARY KEY (call_id, idx))"
         )
         # Create indexes
         await db.execute(
-            f"CREATE INDEX IF NOT EXISTS {self._config.table}_data_initiate_phone_number ON {self._config.table} (JSON_EXTRACT(data, '$.initiate.phone_number'))"
+            f"CREATE INDEX IF NOT EXISTS {self._config.table}_phone_number_created_at ON {self._config.table} (phone_number, created_at)"
+        )
+        await db.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._config.table}_policyholder_phone_created_at ON {self._config.table} (policyholder_phone, created_at)"
         )
         await db.execute(
-            f"CREATE INDEX IF NOT EXISTS {self._config.table}_data_created_at ON {self._config.table} (DATETIME(JSON_EXTRACT(data, '$.created_at')))"
+            f"CREATE INDEX IF NOT EXISTS {self._config.table}_created_at ON {self._config.table} (created_at)"
         )
         await db.execute(
-            f"CREATE INDEX IF NOT EXISTS {self._config.table}_data_claim_policyholder_phone ON {self._config.table} (JSON_EXTRACT(data, '$.claim.policyholder_phone'))"
+            f"CREATE INDEX IF NOT EXISTS {self._config.table}_in_progress ON {self._config.table} (in_progress)"
         )
 
+        # Migrate data from the previous schema
+        await self._migrate_db(db)
+
         # Write changes to disk
         await db.commit()
 
+    async def _migrate_db(self, db: Connection) -> None:
+        """
+        Copy the calls from the most recent previous schema version, if any.
+
+        Calls are parsed and written with the current schema, so the searchable columns are filled. Older file is kept as is. Database is not usable until done, the store is opened at startup for this.
+        """
+        for version in range(self._config.schema_version - 1, 0, -1):
+            old_path = f"{self._config.path}-v{version}.sqlite"
+            if os.path.isfile(old_path):
+                break
+        else:
+            return
+
+        logger.warning(
+            "Migrating calls from %s, database is blocked until done", old_path
+        )
+        count = 0
+        async with sqlite_connect(database=old_path) as old_db:
+            # Messages are either in a dedicated table, or in the call document
+            cursor = await old_db.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (f"{self._config.table}_messages",),
+            )
+            row = await cursor.fetchone()
+            data_select = self._data_select if row and row[0] else "data"
+            cursor = await old_db.execute(
+                f"SELECT {data_select} FROM {self._config.table}"
+            )
+            async for row in cursor:
+                try:
+                    call = CallStateModel.model_validate_json(row[0])
+                except ValidationError:
+                    logger.debug("Parsing error", exc_info=True)
+                    continue
+                data = call.model_dump(mode="json", exclude_none=True)
+                data.pop("messages", None)
+                await self._call_awrite(call=call, data=data, db=db)
+                count += 1
+                if count % 1000 == 0:  # Commit by batch to bound the journal size
+                    await db.commit()
+                    logger.info("Migrated %s calls", count)
+        logger.info("Migration done, %s calls migrated", count)
+
     @asynccontextmanager
-    async def _use_db(self) -> AsyncGenerator[Connection, None]:
+    async def _use_db(self, write: bool = False) -> AsyncGenerator[Connection, None]:
+        """
+        Use a connection from the pool.
+
+        Writes are serialized on a single connection, as SQLite allows only one writer at a time. Reads are spread over `pool_size` connections, which are not blocked by the writer thanks to WAL.
+        """
+        writer = await self._use_writer()
+
+        # Write connection
+        if write:
+            async with self._writer_lock:
+                done = False
+                try:
+                    yield writer
+                    done = True
+                finally:
+                    if (
+                        not done
+                    ):  # Do not leak a partial transaction to the next write, even if cancelled
+                        await writer.rollback()
+            return
+
+        # Read connections, opened on demand up to the pool size
+        if self._readers.empty() and self._readers_count < self._config.pool_size:
+            self._readers_count += 1
+            try:
+                reader = await self._connect()
+            except Exception:
+                self._readers_count -= 1
+                raise
+        else:
+            reader = await self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def _use_writer(self) -> Connection:
+        """
+        Get the write connection, initializing the database on first use.
+        """
+        if not self._writer:
+            async with self._init_lock:  # Init only once
+                if not self._writer:
+                    writer = await self._connect()
+                    if self._first_run_done:
+                        await self._init_db(writer)
+                        self._first_run_done = False
+                    self._writer = writer
+        return self._writer
+
+    async def _connect(self) -> Connection:
         """
-        Generate the SQLite client and close it after use.
+        Open a connection, tuned for a concurrent workload.
+
+        Statements are cached by the connection, so the SQL of each query is compiled once.
+
+        See: https://www.sqlite.org/pragma.html
         """
-        async with sqlite_connect(
+        connection = sqlite_connect(
+            cached_statements=256,
             database=self._db_path,
-        ) as client:
-            if self._first_run_done:
-                await self._init_db(client)
-            yield client
+        )
+        connection.daemon = (
+            True  # Pooled connections live with the process, do not block its exit
+        )
+        await connection
+        await connection.executescript(
+            """
+            PRAGMA journal_mode=WAL; -- Readers do not block the writer, and vice versa
+            PRAGMA synchronous=NORMAL; -- Durable enough with WAL, fsync only at checkpoints
+            PRAGMA mmap_size=268435456; -- Read pages through memory mapping, up to 256 MiB
+            PRAGMA cache_size=-16000; -- Page cache of 16 MiB per connection
+            PRAGMA temp_store=MEMORY; -- Temporary tables and indexes in memory
+            PRAGMA busy_timeout=5000; -- Wait for locks of other processes, up to 5 secs
+            """
+        )
+        return connection
@@ -0,0 +1,446 @@
+import asyncio
+import base64
+import binascii
+import json
+from abc import abstractmethod
+from collections import OrderedDict
+from contextlib import aclosing
+from datetime import datetime
+from typing import Any, AsyncGenerator, Optional
+from uuid import UUID
+from weakref import WeakValueDictionary
+
+from helpers.config import CONFIG
+from helpers.logging import logger
+from helpers.monitoring import tracer
+from helpers.single_flight import SingleFlight
+from models.call import CallListModel, CallPageModel, CallStateModel
+from persistence.icache import ICache
+from persistence.istore import IStore
+
+
+class AbstractStore(IStore):
+    """
+    Shared implementation of the stores.
+
+    Reads go through the cache, and writes are made with write-behind. Backends implement the live reads and writes.
+    """
+
+    _call_aget_flight: SingleFlight[Optional[CallStateModel]]
+    _flush_failures: dict[UUID, int]
+    _pending_calls: dict[
+        UUID, str
+    ]  # Saved states, serialized as the caller keeps mutating the call
+    _persisted_fingerprints: OrderedDict[
+        UUID, tuple[tuple[dict[str, int], list[int]], Any]
+    ]
+    _pending_tasks: dict[UUID, asyncio.Task]
+    _write_locks: WeakValueDictionary[UUID, asyncio.Lock]
+
+    def __init__(self, cache: ICache):
+        super().__init__(cache)
+        self._call_aget_flight = SingleFlight(
+            copy=lambda call: call.model_copy(deep=True) if call else call
+        )
+        self._flush_failures = {}
+        self._pending_calls = {}
+        self._persisted_fingerprints = OrderedDict()
+        self._pending_tasks = {}
+        self._write_locks = WeakValueDictionary()
+
+    @tracer.start_as_current_span("store_call_aget")
+    async def call_aget(self, call_id: UUID) -> Optional[CallStateModel]:
+        """
+        Get a call.
+
+        Concurrent gets of the same call share a single backend request. Each caller gets its own copy, as calls are mutated.
+        """
+        return await self._call_aget_flight.arun(
+            key=call_id,
+            func=lambda: self._call_aget(call_id),
+        )
+
+    @abstractmethod
+    async def _call_aget(self, call_id: UUID) -> Optional[CallStateModel]:
+        """
+        Get a call, from the cache, then the pending writes, then the DB.
+
+        Cache is read first, as it is shared by the instances and holds the last saved state. Pending writes of this instance are used if the cache evicted the call.
+        """
+
+    @tracer.start_as_current_span("store_call_aset")
+    async def call_aset(self, call: CallStateModel, flush: bool = False) -> bool:
+        """
+        Save a call, with write-behind.
+
+        The cache is updated immediately, so readers always get the last state. The DB write is debounced per call: back-to-back saves within `write_behind_delay_sec` are merged into a single write of the last state. Writes of the same call are serialized, and a state saved since by another instance is not written, so the DB is never overwritten by an older state.
+
+        Use `flush` when the state must be in the DB when returning (e.g. hangup, or read by a search). Returns `True` if the save succeeded or is scheduled.
+        """
+        # Update cache
+        value = call.model_dump_json()
+        cache_key_id = self._cache_key_call_id(call.call_id)
+        await self._cache.aset(
+            key=cache_key_id,
+            ttl_sec=self._cache_ttl_sec(),
+            value=value,
+        )  # Update for ID
+        cache_key_phone_number = self._cache_key_phone_number(
+            call.initiate.phone_number
+        )
+        await self._cache.adel(
+            cache_key_phone_number
+        )  # Invalidate for phone number because we don't know if it's the same call
+
+        # Schedule live, last state wins
+        self._pending_calls[call.call_id] = value
+        delay = CONFIG.database.write_behind_delay_sec
+        if flush or not delay:
+            return await self.call_aflush(call.call_id)
+        if call.call_id not in self._pending_tasks:
+            self._pending_tasks[call.call_id] = asyncio.create_task(
+                self._call_aflush_delayed(call_id=call.call_id, delay=delay)
+            )
+        return True
+
+    @tracer.start_as_current_span("store_call_aflush")
+    async def call_aflush(self, call_id: Optional[UUID] = None) -> bool:
+        """
+        Write the pending saves to the DB now.
+
+        If `call_id` is not provided, all the pending calls are written. Failed writes are kept and retried with an exponential backoff, until written or replaced by a newer save. Returns `True` if all writes succeeded.
+        """
+        if not call_id:
+            res = await asyncio.gather(
+                *[
+                    self.call_aflush(pending_id)
+                    for pending_id in list(self._pending_calls)
+                ]
+            )
+            return all(res)
+
+        lock = self._write_locks.get(call_id)
+        if not lock:
+            lock = asyncio.Lock()
+            self._write_locks[call_id] = lock
+        async with lock:  # Serialize writes of the same call
+            value = self._pending_calls.pop(call_id, None)
+            if not value:  # Already written by a concurrent flush
+                return True
+            task = self._pending_tasks.pop(call_id, None)
+            if task and task is not asyncio.current_task():
+                task.cancel()
+            try:
+                if await self._call_is_outdated(call_id=call_id, value=value):
+                    logger.debug("Call %s saved by another instance", call_id)
+                    res = True
+                else:
+                    logger.debug("Flushing call %s", call_id)
+                    res = await self._call_aset_live(
+                        CallStateModel.model_validate_json(value)
+                    )  # Write the saved state, not the current one of the caller
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.error("Error flushing call %s", call_id, exc_info=True)
+                res = False
+            if res:
+                self._flush_failures.pop(call_id, None)
+            else:  # Keep it for the next flush, if no newer state is pending
+                self._pending_calls.setdefault(call_id, value)
+                self._call_aflush_retry(call_id)
+            return res
+
+    async def _call_is_outdated(self, call_id: UUID, value: str) -> bool:
+        """
+        Test if a newer state of the call has been saved since, by another instance.
+
+        The cache holds the last saved state. If the call has been evicted from the cache, the state is considered as the last one.
+        """
+        cached = await self._cache.aget(self._cache_key_call_id(call_id))
+        return bool(cached) and cached.decode() != value
+
+    def _call_aflush_retry(self, call_id: UUID) -> None:
+        """
+        Schedule a new flush of a call, after a failed write.
+
+        Delay is doubled on each failure, from `write_behind_delay_sec` (or 1 sec) to 1 min.
+        """
+        if call_id in self._pending_tasks:  # Already scheduled
+            return
+        failures = self._flush_failures.get(call_id, 0) + 1
+        self._flush_failures[call_id] = failures
+        delay = min(
+            max(CONFIG.database.write_behind_delay_sec, 1) * 2 ** (failures - 1),
+            60,
+        )
+        logger.warning("Retrying flush of call %s in %ss", call_id, delay)
+        self._pending_tasks[call_id] = asyncio.create_task(
+            self._call_aflush_delayed(call_id=call_id, delay=delay)
+        )
+
+    async def _call_aflush_delayed(self, call_id: UUID, delay: float) -> None:
+        """
+        Flush a call after the debounce delay.
+        """
+        await asyncio.sleep(delay)
+        self._pending_tasks.pop(call_id, None)  # Next saves will schedule a new flush
+        await self.call_aflush(call_id)
+
+    @abstractmethod
+    async def _call_aset_live(self, call: CallStateModel) -> bool:
+        """
+        Write a call to the DB, without cache.
+        """
+
+    @tracer.start_as_current_span("store_call_asearch_one")
+    async def call_asearch_one(self, phone_number: str) -> Optional[CallStateModel]:
+        """
+        Get the last call of a phone number, within the callback timeout.
+
+        The call is searched in the DB, which can be behind the last saved state with write-behind. The call found is then read like `call_aget`, from the cache and the pending writes first.
+        """
+        call = await self._call_asearch_one(phone_number)
+        if not call:
+            return None
+        return await self.call_aget(call.call_id) or call
+
+    @abstractmethod
+    async def _call_asearch_one(self, phone_number: str) -> Optional[CallStateModel]:
+        """
+        Search the last call of a phone number, from the phone number cache, then the DB.
+        """
+
+    @tracer.start_as_current_span("store_call_asearch_all")
+    async def call_asearch_all(
+        self,
+        count: int,
+        continuation: Optional[str] = None,
+        phone_number: Optional[str] = None,
+    ) -> CallPageModel:
+        """
+        List calls, most recent first, projected for list views.
+
+        `continuation` is the token returned with the previous page. The total is cached for `database.total_cache_ttl_sec`, as counting scans the whole history.
+
+        Raises `ValueError` if the continuation token is invalid.
+        """
+        logger.debug("Searching calls, for %s and count %s", phone_number, count)
+        after = self._continuation_decode(continuation) if continuation else None
+        (calls, last), total = await asyncio.gather(
+            self._call_asearch_all_live(
+                after=after,
+                count=count,
+                phone_number=phone_number,
+            ),
+            self._call_acount(phone_number),
+        )
+        return CallPageModel(
+            calls=calls,
+            continuation=(
+                self._continuation_encode(last)
+                if last is not None and len(calls) == count
+                else None
+            ),  # A partial page is the last one
+            total=total,
+        )
+
+    async def _call_acount(self, phone_number: Optional[str]) -> int:
+        # Try cache
+        cache_key = self._cache_key_count(phone_number)
+        cached = await self._cache.aget(cache_key)
+        if cached:
+            return int(cached.decode())
+
+        # Try live
+        total = await self._call_acount_live(phone_number)
+
+        # Update cache
+        await self._cache.aset(
+            key=cache_key,
+            ttl_sec=CONFIG.database.total_cache_ttl_sec,
+            value=str(total),
+        )
+        return total
+
+    @abstractmethod
+    async def _call_asearch_all_live(
+        self,
+        after: Optional[list[Any]],
+        count: int,
+        phone_number: Optional[str],
+    ) -> tuple[list[CallListModel], Optional[list[Any]]]:
+        """
+        List calls from the DB, starting after the position `after`.
+
+        Returns the calls, and the position of the last one, as a JSON-able list.
+        """
+
+    @abstractmethod
+    async def _call_acount_live(self, phone_number: Optional[str]) -> int:
+        """
+        Count calls in the DB, without cache.
+        """
+
+    async def call_aexport(
+        self,
+        continuation: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> AsyncGenerator[tuple[CallStateModel, str], None]:
+        """
+        Iterate over all the calls, oldest first, created in `[since, until)`.
+
+        Calls are read from the DB as they are consumed, so memory is constant whatever the count. Each call is yielded with the continuation token to resume after it.
+
+        Raises `ValueError` if the continuation token is invalid. DB errors are raised as is, so the export can be resumed from the last continuation token yielded.
+        """
+        after = self._continuation_decode(continuation) if continuation else None
+        async with aclosing(
+            self._call_aexport_live(
+                after=after,
+                since=since,
+                until=until,
+            )
+        ) as calls:  # Release the DB connection as soon as the export is closed
+            async for call, position in calls:
+                yield call, self._continuation_encode(position)
+
+    @abstractmethod
+    async def _call_aexport_live(
+        self,
+        after: Optional[list[Any]],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> AsyncGenerator[tuple[CallStateModel, list[Any]], None]:
+        """
+        Iterate over the calls from the DB, oldest first, starting after the position `after`.
+
+        Yields each call, and its position as a JSON-able list.
+        """
+        raise NotImplementedError
+        yield  # pylint: disable=unreachable # Async generator, like the implementations
+
+    @staticmethod
+    def _continuation_encode(position: list[Any]) -> str:
+        """
+        Encode a list position to an opaque, URL-safe, continuation token.
+        """
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    @staticmethod
+    def _continuation_decode(token: str) -> list[Any]:
+        """
+        Decode a continuation token to a list position.
+
+        Raises `ValueError` if the token is invalid.
+        """
+        try:
+            position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError("Invalid continuation token") from e
+        if not isinstance(position, list):
+            raise ValueError("Invalid continuation token")
+        return position
+
+    def _call_delta(self, call: CallStateModel) -> tuple[
+        dict[str, Any],
+        Optional[tuple[dict[str, Any], dict[int, Any], int]],
+        tuple[dict[str, int], list[int]],
+        Any,
+    ]:
+        """
+        Compute what changed in a call since its last write by this instance.
+
+        Messages are compared by index, as they are only appended or edited in place, and other fields are compared at top-level.
+
+        Returns a tuple with:
+
+        1. `dict[str, Any]`, the JSON-able call, without the messages
+        2. `Optional[tuple]`, the changed fields, the changed messages by index, and the count of messages already written, `None` if the last written state is unknown or a field or message was removed, meaning the whole call must be written
+        3. `tuple`, the fingerprints to commit with `_call_delta_commit` once written
+        4. `Any`, the version of the last write, to detect concurrent writes from other instances
+        """
+        data = call.model_dump(mode="json", exclude_none=True)
+        messages: list[dict[str, Any]] = data.pop("messages", [])
+        fields_fingerprints = {
+            key: hash(json.dumps(value, sort_keys=True)) for key, value in data.items()
+        }
+        messages_fingerprints = [
+            hash(json.dumps(message, sort_keys=True)) for message in messages
+        ]
+        fingerprints = (fields_fingerprints, messages_fingerprints)
+
+        # Unknown state or removed data, whole call must be written
+        persisted = self._persisted_fingerprints.get(call.call_id, None)
+        if not persisted:
+            return data, None, fingerprints, None
+        (persisted_fields, persisted_messages), version = persisted
+        if persisted_fields.keys() - fields_fingerprints.keys() or len(
+            persisted_messages
+        ) > len(messages_fingerprints):
+            return data, None, fingerprints, version
+
+        fields = {
+            key: data[key]
+            for key, fingerprint in fields_fingerprints.items()
+            if persisted_fields.get(key, None) != fingerprint
+        }
+        changed_messages = {
+            i: messages[i]
+            for i, fingerprint in enumerate(messages_fingerprints)
+            if i >= len(persisted_messages) or persisted_messages[i] != fingerprint
+        }
+        return (
+            data,
+            (fields, changed_messages, len(persisted_messages)),
+            fingerprints,
+            version,
+        )
+
+    def _call_delta_commit(
+        self,
+        call_id: UUID,
+        fingerprints: tuple[dict[str, int], list[int]],
+        version: Any,
+    ) -> None:
+        """
+        Remember the last written state of a call, for the next delta.
+
+        Only the most recent calls are kept, older calls will be fully written on their next save.
+        """
+        self._persisted_fingerprints[call_id] = (fingerprints, version)
+        self._persisted_fingerprints.move_to_end(call_id)
+        while len(self._persisted_fingerprints) > 1000:
+            self._persisted_fingerprints.popitem(last=False)
+
+    def _call_delta_reset(self, call_id: UUID) -> None:
+        """
+        Forget the last written state of a call, next save will write the whole call.
+        """
+        self._persisted_fingerprints.pop(call_id, None)
+
+    def _pending_call(self, call_id: UUID) -> Optional[CallStateModel]:
+        """
+        Get the pending state of a call, not yet written to the DB.
+
+        Returns a new object, from the saved state.
+        """
+        value = self._pending_calls.get(call_id, None)
+        return CallStateModel.model_validate_json(value) if value else None
+
+    @staticmethod
+    def _cache_ttl_sec() -> int:
+        """
+        Get the cache TTL of a call.
+
+        A call can be resumed until the callback timeout, there is no need to keep it longer in cache.
+        """
+        return CONFIG.conversation.callback_timeout_hour * 60 * 60
+
+    def _cache_key_call_id(self, call_id: UUID) -> str:
+        return f"{self.__class__.__name__}-call_id-{call_id}"
+
+    def _cache_key_phone_number(self, phone_number: str) -> str:
+        return f"{self.__class__.__name__}-phone_number-{phone_number}"
+
+    def _cache_key_count(self, phone_number: Optional[str]) -> str:
+        return f"{self.__class__.__name__}-count-{phone_number or '*'}"
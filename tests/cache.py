@@ -1,8 +1,20 @@
+import asyncio
+import time
+
 import pytest
 from pytest import assume  # pylint: disable=no-name-in-module # pyright: ignore
 
 from helpers.config import CONFIG
-from helpers.config_models.cache import ModeEnum as CacheModeEnum
+from helpers.config_models.cache import (
+    CodecEnum,
+    MemoryModel,
+    ModeEnum as CacheModeEnum,
+)
+from helpers.logging import logger
+from models.call import CallStateModel
+from models.message import MessageModel, PersonaEnum as MessagePersonaEnum
+from persistence.codec import decode, encode
+from persistence.memory import MemoryCache
 
 
 @pytest.mark.parametrize(
@@ -48,3 +60,99 @@ async def test_acid(random_text: str, cache_mode: CacheModeEnum) -> None:
 
     # Check point read
     assume(await cache.aget(test_key) == test_value.encode())
+
+
+@pytest.mark.asyncio(scope="session")
+async def test_memory_lru(random_text: str) -> None:
+    """
+    Test eviction and expiration of the memory cache.
+
+    Steps:
+    1. Fill the cache over its size in bytes
+    2. Check the least recently used item is evicted
+    3. Check an empty value is a hit
+    4. Check an item expires after its TTL
+    """
+    cache = MemoryCache(
+        MemoryModel(
+            max_bytes=1024,
+            max_size=10,
+        )
+    )
+
+    # Fill the cache, each item is a bit more than a third of the budget
+    value = "x" * 300
+    await cache.aset(f"{random_text}-1", value)
+    await cache.aset(f"{random_text}-2", value)
+    assume(await cache.aget(f"{random_text}-1") == value.encode())  # Mark as used
+    await cache.aset(f"{random_text}-3", value)
+
+    # Check the least recently used is evicted
+    assume(await cache.aget(f"{random_text}-1") == value.encode())
+    assume(not await cache.aget(f"{random_text}-2"))
+    assume(await cache.aget(f"{random_text}-3") == value.encode())
+
+    # Check empty value is a hit
+    await cache.aset(f"{random_text}-empty", b"")
+    assume(await cache.aget(f"{random_text}-empty") == b"")
+
+    # Check expiration
+    await cache.aset(f"{random_text}-ttl", value, ttl_sec=1)
+    assume(await cache.aget(f"{random_text}-ttl") == value.encode())
+    await asyncio.sleep(1.1)
+    assume(not await cache.aget(f"{random_text}-ttl"))
+
+
+def test_codec(call: CallStateModel) -> None:
+    """
+    Test and benchmark the cache codec, on a long conversation.
+
+    Steps:
+    1. Create a 30 mins conversation
+    2. Encode and decode it with each codec
+    3. Check payload is the same after a round trip
+    4. Check compressed payload is smaller
+    5. Check plain payloads are decoded as is, even starting with a multi-byte character
+    """
+    # Create a long conversation, a message every 10 secs
+    for i in range(180):
+        call.messages.append(
+            MessageModel(
+                content=f"Message {i}, my car was damaged yesterday evening in the parking lot of the supermarket, the rear bumper is broken and I would like to know if my insurance covers it.",
+                persona=(
+                    MessagePersonaEnum.HUMAN
+                    if i % 2 == 0
+                    else MessagePersonaEnum.ASSISTANT
+                ),
+            )
+        )
+    payload = call.model_dump_json().encode()
+
+    sizes: dict[CodecEnum, int] = {}
+    for codec in CodecEnum:
+        start = time.perf_counter()
+        encoded = encode(payload, codec)
+        encode_duration = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = decode(encoded)
+        decode_duration = time.perf_counter() - start
+        sizes[codec] = len(encoded)
+        logger.info(
+            "Codec %s: %s bytes, encoded in %.3f ms, decoded in %.3f ms",
+            codec.value,
+            len(encoded),
+            encode_duration * 1000,
+            decode_duration * 1000,
+        )
+
+        # Check round trip
+        assume(decoded == payload)
+
+    # Check compression
+    assume(sizes[CodecEnum.ZLIB] < sizes[CodecEnum.NONE] / 4)
+
+    # Check plain payloads, "\u0300" is encoded as b"\xcc\x80" in UTF-8
+    for text in ("\u0300 combining accent", "\U0001f697 car emoji", "plain"):
+        plain = text.encode()
+        assume(decode(plain) == plain)
+        assume(decode(encode(plain, CodecEnum.ZLIB)) == plain)
@@ -2,8 +2,9 @@ import asyncio
 import json
 import re
 from datetime import datetime
-from typing import Optional
+from typing import AsyncGenerator, Optional
 
+import httpx
 import pytest
 from deepeval import assert_test
 from deepeval.metrics import (
@@ -15,9 +16,12 @@ from deepeval.metrics import (
 )
 from deepeval.models.gpt_model import GPTModel
 from deepeval.test_case import LLMTestCase
+from openai import APIConnectionError
+from openai.types.chat.chat_completion_chunk import ChoiceDelta
 from pydantic import TypeAdapter
 from pytest import assume  # pylint: disable=no-name-in-module # pyright: ignore
 
+from helpers import call_llm, llm_worker
 from helpers.call_events import (
     on_call_connected,
     on_call_disconnected,
@@ -26,8 +30,12 @@ from helpers.call_events import (
     on_play_completed,
     on_speech_recognized,
 )
+from helpers.call_utils import handle_recognize_text
+from helpers.config import CONFIG
+from helpers.llm_worker import _limit_messages
 from helpers.logging import logger
 from models.call import CallStateModel
+from models.message import MessageModel, PersonaEnum as MessagePersonaEnum
 from models.reminder import ReminderModel
 from models.training import TrainingModel
 from tests.conftest import CallAutomationClientMock, with_conversations
@@ -363,6 +371,317 @@ async def test_llm(
     assert_test(test_case, llm_metrics)
 
 
+def test_limit_messages(call: CallStateModel) -> None:
+    """
+    Test the token ledger gives the same prompt as a full tokenization.
+
+    Steps:
+    1. Create a conversation
+    2. Limit messages with and without the ledger
+    3. Append, edit and remove messages, and compare again
+    4. Check the ledger is kept when the call is reloaded
+    """
+    platform = CONFIG.llm.selected(True)
+
+    def _limit(use_ledger: bool) -> tuple[list, int]:
+        return _limit_messages(
+            context_window=platform.context,
+            max_tokens=1000,
+            messages=call.messages,
+            model=platform.model,
+            system=[],
+            token_ledger=call.token_ledger if use_ledger else None,
+        )
+
+    # Create a conversation
+    for i in range(10):
+        call.messages.append(
+            MessageModel(
+                content=f"Message {i}, my car was damaged in the parking lot.",
+                persona=(
+                    MessagePersonaEnum.HUMAN
+                    if i % 2 == 0
+                    else MessagePersonaEnum.ASSISTANT
+                ),
+            )
+        )
+    assume(_limit(True) == _limit(False))
+
+    # Append a message
+    call.messages.append(
+        MessageModel(
+            content="The rear bumper is broken.",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    assume(_limit(True) == _limit(False))
+
+    # Edit the last message, as done while streaming
+    call.messages[-1].content += " And the left headlight too, a long sentence."
+    assume(_limit(True) == _limit(False))
+
+    # Remove messages
+    call.messages = call.messages[:5]
+    assume(_limit(True) == _limit(False))
+
+    # Check the ledger is kept when reloaded
+    reloaded = CallStateModel.model_validate_json(call.model_dump_json())
+    assume(reloaded.token_ledger is call.token_ledger)
+    assume(reloaded == call)
+
+
+@pytest.mark.asyncio(scope="session")
+async def test_playback_lag(
+    call: CallStateModel, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Test the answer is stored once, when the TTS is slower than the LLM.
+
+    Steps:
+    1. Mock a fast LLM stream and a slow TTS
+    2. Run the chat
+    3. Check the answer is stored once, in memory and in DB
+    """
+    sentences = [
+        "I am sorry to hear that.",
+        "Can you tell me where the accident happened?",
+        "Was anyone injured?",
+    ]
+
+    async def _completion_stream(*args, **kwargs) -> AsyncGenerator[ChoiceDelta, None]:
+        for sentence in sentences:
+            yield ChoiceDelta(content=f"{sentence} ")
+
+    async def _slow_recognize_text(*args, **kwargs) -> None:
+        await asyncio.sleep(0.2)  # Slower than the LLM
+        await handle_recognize_text(*args, **kwargs)
+
+    async def _callback(_call: CallStateModel) -> None:
+        pass
+
+    # Mock LLM and TTS
+    monkeypatch.setattr(call_llm, "completion_stream", _completion_stream)
+    monkeypatch.setattr(call_llm, "handle_recognize_text", _slow_recognize_text)
+    played: list[str] = []
+    automation_client = CallAutomationClientMock(
+        hang_up_callback=lambda: None,
+        play_media_callback=played.append,
+        transfer_callback=lambda: None,
+    )
+
+    # Run the chat
+    call.messages.append(
+        MessageModel(
+            content="My car was damaged in the parking lot.",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    call = await call_llm.load_llm_chat(
+        call=call,
+        client=automation_client,
+        post_callback=_callback,
+        trainings_callback=_callback,
+        _iterations_remaining=0,  # Disable tools
+    )
+
+    # Check the answer is stored once
+    answers = [
+        message
+        for message in call.messages
+        if message.persona == MessagePersonaEnum.ASSISTANT
+    ]
+    assume(len(answers) == 1)
+    assume(answers[0].content == " ".join(sentences))
+    stored = await CONFIG.database.instance().call_aget(call.call_id)
+    assume(stored and stored.messages == call.messages)
+    # Check all the sentences are played
+    assume(all(any(sentence in text for text in played) for sentence in sentences))
+
+
+@pytest.mark.asyncio(scope="session")
+async def test_playback_cut_off(
+    call: CallStateModel, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Test the spoken part of an answer is stored before the answer is complete.
+
+    Steps:
+    1. Mock a LLM stream stopping after the first sentence
+    2. Run the chat, and wait for the first sentence to be played
+    3. Check the first sentence is stored, in memory and in DB
+    4. Complete the answer, and check it is stored once
+    """
+    sentences = [
+        "I am sorry to hear that.",
+        "Can you tell me where the accident happened?",
+    ]
+    resume = asyncio.Event()
+
+    async def _completion_stream(*args, **kwargs) -> AsyncGenerator[ChoiceDelta, None]:
+        yield ChoiceDelta(content=f"{sentences[0]} ")
+        await resume.wait()  # User may cut off the Assistant here
+        yield ChoiceDelta(content=sentences[1])
+
+    async def _callback(_call: CallStateModel) -> None:
+        pass
+
+    # Mock LLM
+    monkeypatch.setattr(call_llm, "completion_stream", _completion_stream)
+    automation_client = CallAutomationClientMock(
+        hang_up_callback=lambda: None,
+        play_media_callback=lambda _: None,
+        transfer_callback=lambda: None,
+    )
+
+    # Run the chat, until the first sentence is played
+    call.messages.append(
+        MessageModel(
+            content="My car was damaged in the parking lot.",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    chat_task = asyncio.create_task(
+        call_llm.load_llm_chat(
+            call=call,
+            client=automation_client,
+            post_callback=_callback,
+            trainings_callback=_callback,
+            _iterations_remaining=0,  # Disable tools
+        )
+    )
+    await asyncio.sleep(0.5)
+
+    # Check the first sentence is stored
+    assume(call.messages[-1].persona == MessagePersonaEnum.ASSISTANT)
+    assume(call.messages[-1].content.strip() == sentences[0])
+    stored = await CONFIG.database.instance().call_aget(call.call_id)
+    assume(stored and stored.messages[-1].content.strip() == sentences[0])
+
+    # Complete the answer
+    resume.set()
+    call = await chat_task
+    answers = [
+        message
+        for message in call.messages
+        if message.persona == MessagePersonaEnum.ASSISTANT
+    ]
+    assume(len(answers) == 1)
+    assume(answers[0].content == " ".join(sentences))
+
+
+@pytest.mark.parametrize(
+    "primary_delay_sec, primary_fails, hedge_fails, expected",
+    [
+        pytest.param(
+            0,
+            False,
+            False,
+            "primary",
+            id="fast_primary",
+        ),
+        pytest.param(
+            1,
+            False,
+            False,
+            "hedge",
+            id="slow_primary",
+        ),
+        pytest.param(
+            0,
+            True,
+            False,
+            "hedge",
+            id="failed_primary",
+        ),
+        pytest.param(
+            0,
+            True,
+            True,
+            None,
+            id="both_failed",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_completion_stream_hedged(
+    call: CallStateModel,
+    expected: Optional[str],
+    hedge_fails: bool,
+    monkeypatch: pytest.MonkeyPatch,
+    primary_delay_sec: float,
+    primary_fails: bool,
+) -> None:
+    """
+    Test hedged LLM requests, with mocked LLM streams.
+
+    Steps:
+    1. Mock the primary and the hedge LLMs, with their delay and failure
+    2. Stream a completion, hedging after 0.1 sec
+    3. Check the completion comes from the expected LLM, or the error is raised
+    4. Check the losing stream is cancelled, and no stream is left running
+    """
+    is_primary_fast = not CONFIG.conversation.slow_llm_for_chat
+    started: list[str] = []
+    cancelled: list[str] = []
+    running: set[str] = set()
+
+    async def _completion_stream_worker(
+        is_fast: bool, **kwargs
+    ) -> AsyncGenerator[ChoiceDelta, None]:
+        name = "primary" if is_fast == is_primary_fast else "hedge"
+        started.append(name)
+        running.add(name)
+        try:
+            await asyncio.sleep(primary_delay_sec if name == "primary" else 0.2)
+            if primary_fails if name == "primary" else hedge_fails:
+                raise APIConnectionError(
+                    request=httpx.Request(method="POST", url="https://localhost")
+                )
+            for word in (name, "answers"):
+                yield ChoiceDelta(content=f"{word} ")
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+        finally:
+            running.discard(name)
+
+    # Mock LLMs
+    monkeypatch.setattr(
+        llm_worker, "_completion_stream_worker", _completion_stream_worker
+    )
+
+    # Stream the completion
+    content = ""
+    error: Optional[Exception] = None
+    try:
+        async for (
+            delta
+        ) in llm_worker._completion_stream_hedged(  # pylint: disable=protected-access
+            call=call,
+            hedge_timeout_sec=0.1,
+            max_tokens=160,
+            system=[],
+        ):
+            content += delta.content or ""
+    except APIConnectionError as e:
+        error = e
+
+    # Check the result
+    if expected:
+        assume(content == f"{expected} answers ")
+        assume(not error)
+    else:
+        assume(isinstance(error, APIConnectionError))
+    # Check the hedge is started only if needed
+    assume(started == (["primary"] if expected == "primary" else ["primary", "hedge"]))
+    # Check the loser is cancelled
+    if primary_delay_sec and expected == "hedge":
+        assume(cancelled == ["primary"])
+    else:
+        assume(not cancelled)
+    assume(not running)
+
+
 def _remove_newlines(text: str) -> str:
     """
     Remove newlines from a string and return it as a single line.
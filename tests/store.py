@@ -1,9 +1,26 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Optional
+
 import pytest
+from aiosqlite import connect as sqlite_connect
 from pytest import assume  # pylint: disable=no-name-in-module # pyright: ignore
 
 from helpers.config import CONFIG
-from helpers.config_models.database import ModeEnum as DatabaseModeEnum
+from helpers.config_models.cache import MemoryModel
+from helpers.config_models.database import ModeEnum as DatabaseModeEnum, SqliteModel
 from models.call import CallStateModel
+from models.message import (
+    ActionEnum as MessageActionEnum,
+    MessageModel,
+    PersonaEnum as MessagePersonaEnum,
+)
+from persistence.cosmos_db import CosmosDbStore
+from persistence.icache import ICache
+from persistence.memory import MemoryCache
+from persistence.sqlite import SqliteStore
+from persistence.store import AbstractStore
 
 
 @pytest.mark.parametrize(
@@ -41,19 +58,22 @@ async def test_acid(call: CallStateModel, database_mode: DatabaseModeEnum) -> No
     assume(not await db.call_aget(call.call_id))
     assume(await db.call_asearch_one(call.initiate.phone_number) != call)
     assume(
-        call
-        not in (
-            (
+        call.call_id
+        not in [
+            summary.call_id
+            for summary in (
                 await db.call_asearch_all(
                     phone_number=call.initiate.phone_number, count=1
                 )
-            )[0]
-            or []
-        )
+            ).calls
+        ]
     )
 
     # Insert test call
-    await db.call_aset(call)
+    await db.call_aset(
+        call=call,
+        flush=True,  # Searches are made on the DB
+    )
 
     # Check point read
     assume(await db.call_aget(call.call_id) == call)
@@ -61,13 +81,462 @@ async def test_acid(call: CallStateModel, database_mode: DatabaseModeEnum) -> No
     assume(await db.call_asearch_one(call.initiate.phone_number) == call)
     # Check search all
     assume(
-        call
-        in (
-            (
+        call.call_id
+        in [
+            summary.call_id
+            for summary in (
                 await db.call_asearch_all(
                     phone_number=call.initiate.phone_number, count=1
                 )
-            )[0]
-            or []
+            ).calls
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "database_mode",
+    [
+        pytest.param(
+            DatabaseModeEnum.SQLITE,
+            id="sqlite",
+        ),
+        pytest.param(
+            DatabaseModeEnum.COSMOS_DB,
+            id="cosmos_db",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_delta(call: CallStateModel, database_mode: DatabaseModeEnum) -> None:
+    """
+    Test only the changes of a call are written, and a concurrent write falls back to a full write.
+
+    Steps:
+    1. Save a call
+    2. Append a message, save again, and check it from the DB
+    3. Write the call from another instance
+    4. Append a message, save again, and check the whole call is written
+    """
+    # Set database mode
+    CONFIG.database.mode = database_mode
+    db = CONFIG.database.instance()
+
+    def _version() -> object:
+        _, version = db._persisted_fingerprints[  # pylint: disable=protected-access
+            call.call_id
+        ]
+        return version
+
+    # Insert test call
+    await db.call_aset(call=call, flush=True)
+    first_version = _version()
+
+    # Append a message, written as a delta
+    call.messages.append(
+        MessageModel(
+            content="My car was damaged in the parking lot.",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    await db.call_aset(call=call, flush=True)
+    assume(_version() != first_version)
+    live = await _store(database_mode).call_aget(call.call_id)
+    assume(live and live.messages == call.messages)
+
+    # Write from another instance, changes the version in the DB
+    assert live
+    live.messages.append(
+        MessageModel(
+            content="Written by another instance.",
+            persona=MessagePersonaEnum.ASSISTANT,
+        )
+    )
+    await _store(database_mode).call_aset(call=live, flush=True)
+
+    # Append a message, the delta is refused and the whole call is written
+    call.messages.append(
+        MessageModel(
+            content="Can you tell me where the accident happened?",
+            persona=MessagePersonaEnum.ASSISTANT,
+        )
+    )
+    await db.call_aset(call=call, flush=True)
+    live = await _store(database_mode).call_aget(call.call_id)
+    assume(live and live.messages == call.messages)
+
+
+@pytest.mark.parametrize(
+    "database_mode",
+    [
+        pytest.param(
+            DatabaseModeEnum.SQLITE,
+            id="sqlite",
+        ),
+        pytest.param(
+            DatabaseModeEnum.COSMOS_DB,
+            id="cosmos_db",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_search_one_pending(
+    call: CallStateModel,
+    database_mode: DatabaseModeEnum,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test the search of a phone number returns the last saved state, even if not yet written to the DB.
+
+    Steps:
+    1. Save a call in the DB
+    2. Append a message, and save it without flushing
+    3. Search the call by phone number
+    4. Check the message is there
+    """
+    # Set database mode
+    CONFIG.database.mode = database_mode
+    db = CONFIG.database.instance()
+    monkeypatch.setattr(CONFIG.database, "write_behind_delay_sec", 60)
+
+    # Save a call, then a newer state kept in the write-behind
+    await db.call_aset(call=call, flush=True)
+    call.messages.append(
+        MessageModel(
+            content="My car was damaged in the parking lot.",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    await db.call_aset(call)
+
+    # Search returns the newer state
+    found = await db.call_asearch_one(call.initiate.phone_number)
+    assume(found and found.messages == call.messages)
+
+    # Clean up
+    await db.call_aflush(call.call_id)
+
+
+@pytest.mark.parametrize(
+    "database_mode",
+    [
+        pytest.param(
+            DatabaseModeEnum.SQLITE,
+            id="sqlite",
+        ),
+        pytest.param(
+            DatabaseModeEnum.COSMOS_DB,
+            id="cosmos_db",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_write_behind_merge(
+    call: CallStateModel,
+    database_mode: DatabaseModeEnum,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test back-to-back saves are merged into a single write, of the last saved state.
+
+    Steps:
+    1. Save a call several times, without flushing
+    2. Check the call is not written yet
+    3. Wait for the write-behind delay
+    4. Check the last saved state is written once
+    """
+    monkeypatch.setattr(CONFIG.database, "write_behind_delay_sec", 0.5)
+    db = _store(database_mode)
+    writes = _count_writes(db, monkeypatch)
+
+    # Save several times
+    for i in range(3):
+        call.messages.append(
+            MessageModel(
+                content=f"Message {i}",
+                persona=MessagePersonaEnum.HUMAN,
+            )
+        )
+        await db.call_aset(call)
+    call.messages.append(
+        MessageModel(
+            content="Not saved",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )  # Changed after the last save
+    assume(not writes)
+
+    # Check a single write, of the last saved state
+    await asyncio.sleep(1)
+    assume(len(writes) == 1)
+    live = await _store(database_mode).call_aget(call.call_id)
+    assume(live and live.messages == call.messages[:-1])
+
+
+@pytest.mark.parametrize(
+    "database_mode",
+    [
+        pytest.param(
+            DatabaseModeEnum.SQLITE,
+            id="sqlite",
+        ),
+        pytest.param(
+            DatabaseModeEnum.COSMOS_DB,
+            id="cosmos_db",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_write_behind_flush(
+    call: CallStateModel,
+    database_mode: DatabaseModeEnum,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test a flush, as made when the call is disconnected, writes the pending state now.
+
+    Steps:
+    1. Save a call, without flushing
+    2. Save it again with flush, as on disconnection
+    3. Check the last state is written once, and nothing is left pending
+    """
+    monkeypatch.setattr(CONFIG.database, "write_behind_delay_sec", 60)
+    db = _store(database_mode)
+    writes = _count_writes(db, monkeypatch)
+
+    # Save, then flush on disconnection
+    await db.call_aset(call)
+    call.messages.append(
+        MessageModel(
+            action=MessageActionEnum.HANGUP,
+            content="",
+            persona=MessagePersonaEnum.HUMAN,
         )
     )
+    assume(await db.call_aset(call=call, flush=True))
+
+    # Check the last state is written
+    assume(len(writes) == 1)
+    live = await _store(database_mode).call_aget(call.call_id)
+    assume(live and live.messages == call.messages)
+    assume(not db._pending_calls)  # pylint: disable=protected-access
+    assume(not db._pending_tasks)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize(
+    "database_mode",
+    [
+        pytest.param(
+            DatabaseModeEnum.SQLITE,
+            id="sqlite",
+        ),
+        pytest.param(
+            DatabaseModeEnum.COSMOS_DB,
+            id="cosmos_db",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_write_behind_retry(
+    call: CallStateModel,
+    database_mode: DatabaseModeEnum,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test a failed write is kept and retried.
+
+    Steps:
+    1. Mock a DB failing on the first write
+    2. Save a call with flush, and check the failure is returned
+    3. Wait for the retry
+    4. Check the call is written
+    """
+    monkeypatch.setattr(CONFIG.database, "write_behind_delay_sec", 0)
+    db = _store(database_mode)
+    writes = _count_writes(db, monkeypatch, failures=1)
+
+    # First write fails
+    assume(not await db.call_aset(call=call, flush=True))
+    assume(call.call_id in db._pending_calls)  # pylint: disable=protected-access
+
+    # Retried after 1 sec
+    await asyncio.sleep(1.5)
+    assume(len(writes) == 2)
+    live = await _store(database_mode).call_aget(call.call_id)
+    assume(live == call)
+    assume(not db._pending_calls)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize(
+    "database_mode",
+    [
+        pytest.param(
+            DatabaseModeEnum.SQLITE,
+            id="sqlite",
+        ),
+        pytest.param(
+            DatabaseModeEnum.COSMOS_DB,
+            id="cosmos_db",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_write_behind_outdated(
+    call: CallStateModel,
+    database_mode: DatabaseModeEnum,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test a state saved since by another instance is not overwritten by an older one.
+
+    Steps:
+    1. Save a call from a first instance, without flushing
+    2. Save a newer state from a second instance, sharing the cache, with flush
+    3. Wait for the write-behind delay of the first instance
+    4. Check the first instance skipped its write, and the newer state is in the DB
+    """
+    monkeypatch.setattr(CONFIG.database, "write_behind_delay_sec", 0.5)
+    cache = MemoryCache(MemoryModel())
+    first = _store(database_mode, cache)
+    second = _store(database_mode, cache)
+    writes = _count_writes(first, monkeypatch)
+
+    # Save from the first instance
+    call.messages.append(
+        MessageModel(
+            content="From the first instance",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    await first.call_aset(call)
+
+    # Save a newer state from the second instance
+    newer = await second.call_aget(call.call_id)
+    assert newer
+    newer.messages.append(
+        MessageModel(
+            content="From the second instance",
+            persona=MessagePersonaEnum.ASSISTANT,
+        )
+    )
+    await second.call_aset(call=newer, flush=True)
+
+    # Check the older state is not written
+    await asyncio.sleep(1)
+    assume(not writes)
+    live = await _store(database_mode).call_aget(call.call_id)
+    assume(live and live.messages == newer.messages)
+
+
+@pytest.mark.parametrize(
+    "old_version",
+    [
+        pytest.param(
+            3,
+            id="v3_messages_in_call",
+        ),
+        pytest.param(
+            4,
+            id="v4_messages_table",
+        ),
+    ],
+)
+@pytest.mark.asyncio(scope="session")
+async def test_sqlite_migration(
+    call: CallStateModel, old_version: int, tmp_path: Path
+) -> None:
+    """
+    Test the calls of a previous SQLite schema are migrated.
+
+    Steps:
+    1. Create a database with a previous schema, with a call
+    2. Open the database with the current schema
+    3. Check the call and its messages are migrated
+    4. Check the call can be searched
+    """
+    config = SqliteModel(path=str(tmp_path / ".local"))
+    call.messages.append(
+        MessageModel(
+            content="My car was damaged in the parking lot.",
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    data = call.model_dump(mode="json", exclude_none=True)
+
+    # Create the previous database
+    async with sqlite_connect(
+        database=f"{config.path}-v{old_version}.sqlite"
+    ) as old_db:
+        if old_version == 3:  # Messages in the call document
+            await old_db.execute(
+                f"CREATE TABLE {config.table} (id VARCHAR(36) PRIMARY KEY, data TEXT)"
+            )
+            await old_db.execute(
+                f"INSERT INTO {config.table} VALUES (?, ?)",
+                (str(call.call_id), json.dumps(data)),
+            )
+        else:  # Messages in a dedicated table
+            messages = data.pop("messages")
+            await old_db.execute(
+                f"CREATE TABLE {config.table} (id VARCHAR(36) PRIMARY KEY, data TEXT, revision INTEGER NOT NULL DEFAULT 0)"
+            )
+            await old_db.execute(
+                f"CREATE TABLE {config.table}_messages (call_id VARCHAR(36), idx INTEGER, data TEXT, PRIMARY KEY (call_id, idx))"
+            )
+            await old_db.execute(
+                f"INSERT INTO {config.table} VALUES (?, ?, 1)",
+                (str(call.call_id), json.dumps(data)),
+            )
+            await old_db.executemany(
+                f"INSERT INTO {config.table}_messages VALUES (?, ?, ?)",
+                [
+                    (str(call.call_id), idx, json.dumps(message))
+                    for idx, message in enumerate(messages)
+                ],
+            )
+        await old_db.commit()
+
+    # Open with the current schema, migrates on first use
+    db = SqliteStore(MemoryCache(MemoryModel()), config)
+    migrated = await db.call_aget(call.call_id)
+    assume(migrated and migrated.messages == call.messages)
+
+    # Search on the new columns
+    found = await db.call_asearch_one(call.initiate.phone_number)
+    assume(found and found.call_id == call.call_id)
+
+
+def _store(
+    database_mode: DatabaseModeEnum, cache: Optional[ICache] = None
+) -> AbstractStore:
+    """
+    Create a store instance, with its own pending writes.
+
+    Without a shared `cache`, each instance has its own, so reads go to the DB.
+    """
+    cache = cache or MemoryCache(MemoryModel())
+    if database_mode == DatabaseModeEnum.SQLITE:
+        assert CONFIG.database.sqlite
+        return SqliteStore(cache, CONFIG.database.sqlite)
+    assert CONFIG.database.cosmos_db
+    return CosmosDbStore(cache, CONFIG.database.cosmos_db)
+
+
+def _count_writes(
+    db: AbstractStore, monkeypatch: pytest.MonkeyPatch, failures: int = 0
+) -> list[CallStateModel]:
+    """
+    Record the DB writes of a store, the first `failures` ones fail.
+
+    Returns the list of the written calls, updated as they are written.
+    """
+    writes: list[CallStateModel] = []
+    write = db._call_aset_live  # pylint: disable=protected-access
+
+    async def _call_aset_live(call: CallStateModel) -> bool:
+        writes.append(call)
+        if len(writes) <= failures:
+            raise ConnectionError("Mocked DB failure")
+        return await write(call)
+
+    monkeypatch.setattr(db, "_call_aset_live", _call_aset_live)
+    return writes